@@ -0,0 +1,492 @@
+"""Offline load test for BitluMawaBot.
+
+Runs the bot in-process against a local stand-in for the Telegram Bot API and
+replays synthetic traffic: users opening deep links (/start <video_id>), users
+who first have to join the channel and tap "Verify Now", and admins walking
+through /addvideo. Reports updates/sec, API calls per delivery and end-to-end
+latency percentiles. Threshold flags turn it into a regression gate:
+
+    python benchmark.py --users 2000 --max-p99 5 --min-updates-per-sec 100
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from urllib.parse import parse_qsl
+
+BOT_TOKEN = "123456:BENCHMARK"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+ADMIN_BASE_ID = 9_000_000
+
+logger = logging.getLogger("benchmark")
+
+
+def percentile(samples, q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+# ================== FAKE BOT API ==================
+class FakeBotAPI:
+    """Just enough of the Bot API over HTTP/1.1 for the bot's code paths.
+
+    Every call waits ``latency`` seconds (+/- ``jitter``); metered send calls
+    fail with a 429 with probability ``flood_rate``. Subscribers of
+    ``on_call`` see every successful call as ``(method, params, result)``.
+    """
+
+    SEND_METHODS = {
+        "sendMessage", "sendPhoto", "sendVideo", "sendDocument", "sendAudio",
+        "copyMessage", "forwardMessage",
+    }
+
+    def __init__(self, latency: float, jitter: float, flood_rate: float, retry_after: int) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.members = set()
+        self.updates = []
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.new_updates = asyncio.Event()
+        self.calls = {}
+        self.floods = 0
+        self.on_call = []
+        self._writers = set()
+        self._server = None
+        self.port = None
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        self._server.close()
+        # Release parked long polls so their connections can finish
+        self.new_updates.set()
+        for writer in list(self._writers):
+            writer.close()
+        await self._server.wait_closed()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    def push_update(self, payload: dict) -> int:
+        update_id = next(self.update_ids)
+        self.updates.append({"update_id": update_id, **payload})
+        self.new_updates.set()
+        return update_id
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._writers.add(writer)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", "0")))
+
+                path = request_line.decode("latin-1").split()[1]
+                method = path.rsplit("/", 1)[-1]
+                params = self._parse_params(headers.get("content-type", ""), body)
+                status, payload = await self._dispatch(method, params)
+
+                data = json.dumps(payload).encode("utf-8")
+                writer.write(
+                    f"HTTP/1.1 {status} OK\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n\r\n".encode("latin-1") + data
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    @staticmethod
+    def _parse_params(content_type: str, body: bytes) -> dict:
+        if not body:
+            return {}
+        if content_type.startswith("application/json"):
+            return json.loads(body)
+
+        params = {}
+        for key, value in parse_qsl(body.decode("utf-8"), keep_blank_values=True):
+            try:
+                params[key] = json.loads(value)
+            except ValueError:
+                params[key] = value
+        return params
+
+    def _message(self, params: dict, **extra) -> dict:
+        chat_id = params.get("chat_id")
+        return {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if int(chat_id) > 0 else "channel"},
+            "from": BOT_USER,
+            **extra,
+        }
+
+    async def _dispatch(self, method: str, params: dict):
+        if method == "getUpdates":
+            return 200, {"ok": True, "result": await self._get_updates(params)}
+
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self.calls[method] = self.calls.get(method, 0) + 1
+
+        metered = method in self.SEND_METHODS or method == "sendMediaGroup"
+        if metered and self.flood_rate and random.random() < self.flood_rate:
+            self.floods += 1
+            return 429, {
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }
+
+        if method == "getMe":
+            result = BOT_USER
+        elif method == "getChatMember":
+            user_id = int(params["user_id"])
+            status = "member" if user_id in self.members else "left"
+            result = {"status": status, "user": {"id": user_id, "is_bot": False, "first_name": "U"}}
+        elif method == "getChat":
+            result = {"id": -100, "type": "channel", "title": "Bench", "invite_link": "https://t.me/+bench"}
+        elif method in self.SEND_METHODS:
+            result = self._message(params, text=params.get("text") or params.get("caption") or "")
+        elif method == "sendMediaGroup":
+            result = [self._message(params) for _ in params.get("media", [])]
+        elif method == "editMessageText":
+            result = self._message(params, text=params.get("text", ""))
+        else:
+            # deleteWebhook, answerCallbackQuery, answerInlineQuery, ...
+            result = True
+
+        for callback in self.on_call:
+            callback(method, params, result)
+        return 200, {"ok": True, "result": result}
+
+    async def _get_updates(self, params: dict) -> list:
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        self.updates = [u for u in self.updates if u["update_id"] >= offset]
+        if not self.updates:
+            self.new_updates.clear()
+            try:
+                await asyncio.wait_for(self.new_updates.wait(), timeout=float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:limit]
+
+
+# ================== TRAFFIC ==================
+class Traffic:
+    """Builds synthetic updates and tracks when each flow completes."""
+
+    def __init__(self, api: FakeBotAPI, video_ids: list) -> None:
+        self.api = api
+        self.video_ids = video_ids
+        self.message_ids = itertools.count(1)
+        self.pending = {}  # chat_id -> (flow, started_at)
+        self.latencies = {"delivery": [], "verify_delivery": [], "addvideo": []}
+        self.completed = asyncio.Event()
+        self.expected = 0
+        self.done = 0
+        self.updates_sent = 0
+        self.user_calls = 0
+        api.on_call.append(self.observe)
+
+    def _user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+
+    def _message(self, user_id: int, **fields) -> dict:
+        return {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": f"User{user_id}"},
+            "from": self._user(user_id),
+            **fields,
+        }
+
+    def _push(self, payload: dict) -> None:
+        self.api.push_update(payload)
+        self.updates_sent += 1
+
+    def command(self, user_id: int, command: str, args: str = "") -> None:
+        text = f"/{command} {args}".strip()
+        entity = {"type": "bot_command", "offset": 0, "length": len(command) + 1}
+        self._push({"message": self._message(user_id, text=text, entities=[entity])})
+
+    def callback(self, user_id: int, data: str) -> None:
+        message = self._message(user_id, text="...")
+        message["from"] = BOT_USER
+        query = {
+            "id": str(next(self.message_ids)),
+            "from": self._user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": message,
+        }
+        self._push({"callback_query": query})
+
+    def start_user(self, user_id: int, subscribed: bool) -> None:
+        if subscribed:
+            self.api.members.add(user_id)
+        self.expected += 1
+        self.pending[user_id] = ("delivery" if subscribed else "join", time.monotonic())
+        self.command(user_id, "start", random.choice(self.video_ids))
+
+    def start_admin(self, admin_id: int, files: int, album: bool) -> None:
+        self.expected += 1
+        self.pending[admin_id] = ("addvideo", time.monotonic())
+        self.command(admin_id, "addvideo")
+        self._push({"message": self._message(admin_id, text=f"Benchmark Title {admin_id}")})
+        photo = [{"file_id": f"poster{admin_id}", "file_unique_id": f"pu{admin_id}", "width": 1, "height": 1}]
+        self._push({"message": self._message(admin_id, photo=photo)})
+        for i in range(files):
+            video = {
+                "file_id": f"v{admin_id}_{i}", "file_unique_id": f"vu{admin_id}_{i}",
+                "width": 1, "height": 1, "duration": 1,
+            }
+            if album:
+                self._push({"message": self._message(admin_id, video=video, media_group_id=f"mg{admin_id}")})
+            else:
+                self._push({"message": self._message(admin_id, video=video)})
+        if not album:
+            # Albums are finished by the bot itself (ALBUM_AUTO_FINISH)
+            self.callback(admin_id, "finish_video")
+
+    def _finish(self, chat_id: int, flow: str, started_at: float) -> None:
+        self.latencies[flow].append(time.monotonic() - started_at)
+        del self.pending[chat_id]
+        self.done += 1
+        if self.done >= self.expected:
+            self.completed.set()
+
+    def observe(self, method: str, params: dict, result) -> None:
+        chat_id = params.get("chat_id") or params.get("user_id")
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            return
+        if chat_id < ADMIN_BASE_ID:
+            self.user_calls += 1
+
+        flow = self.pending.get(chat_id)
+        if not flow:
+            return
+        kind, started_at = flow
+        text = str(params.get("text", ""))
+        markup = str(params.get("reply_markup", ""))
+
+        if kind == "join" and method == "sendMessage" and "Verify Now" in markup:
+            # The user joins the channel and taps "Verify Now"
+            self.api.members.add(chat_id)
+            self.pending[chat_id] = ("verify_delivery", started_at)
+            data = json.loads(markup) if isinstance(params.get("reply_markup"), str) else params["reply_markup"]
+            verify = data["inline_keyboard"][-1][0]["callback_data"]
+            self.callback(chat_id, verify)
+        elif kind in ("delivery", "verify_delivery") and method == "sendMessage" and (
+            "AMAZING" in text or "Delivery Complete" in text or "not found" in text
+        ):
+            self._finish(chat_id, kind, started_at)
+        elif kind == "addvideo" and method in ("editMessageText", "sendMessage") and "Video Added" in text:
+            self._finish(chat_id, kind, started_at)
+
+
+# ================== RUNNER ==================
+def seed_catalog(bot_module, videos: int, files_per_video: int) -> list:
+    store = bot_module.open_store()
+    catalog = {}
+    for n in range(videos):
+        video_id = f"bench{n}"
+        catalog[video_id] = {
+            "title": f"Benchmark Movie {n} 720p",
+            "poster": f"poster_{n}",
+            # Episodes/qualities as videos plus a trailing document (subtitles, zip)
+            "files": [
+                {"type": "video" if i < files_per_video - 1 else "document", "file_id": f"file_{n}_{i}"}
+                for i in range(files_per_video)
+            ],
+            "created_at": f"2024-01-01T00:00:{n % 60:02d}",
+            "created_by": ADMIN_BASE_ID,
+        }
+    store.upsert_videos(catalog)
+    store.close()
+    return list(catalog)
+
+
+async def run(args) -> dict:
+    api = FakeBotAPI(args.latency, args.jitter, args.flood_rate, args.retry_after)
+    await api.start()
+
+    workdir = tempfile.mkdtemp(prefix="bitlu-bench-")
+    os.environ.update(
+        {
+            "BOT_TOKEN": BOT_TOKEN,
+            "BOT_API_URL": api.base_url,
+            "ADMIN_IDS": ",".join(str(ADMIN_BASE_ID + i) for i in range(max(args.admins, 1))),
+            "DB_PATH": os.path.join(workdir, "bench.db"),
+            "DATA_FILE": os.path.join(workdir, "videos_data.json"),
+            "CONCURRENT_UPDATES": str(args.concurrency),
+            "DELIVERY_MODE": args.delivery_mode,
+            "GLOBAL_RATE_LIMIT": str(args.global_rate),
+            "CHAT_RATE_LIMIT": str(args.chat_rate),
+            "DELIVERY_RETRY_BASE": "0.05",
+            "HEALTH_PORT": "0",
+            "FORCE_SUB_CHANNEL": ",".join(f"@bench{i}" for i in range(args.channels)),
+            "ALBUM_AUTO_FINISH": "1",
+            "ALBUM_DEBOUNCE": "0.2",
+        }
+    )
+    import bot as bot_module
+
+    video_ids = seed_catalog(bot_module, args.videos, args.files)
+    bitlu = bot_module.BitluMawaBot()
+    app = bitlu.app
+
+    await app.initialize()
+    await bitlu.post_init(app)
+    await app.updater.start_polling(poll_interval=0, timeout=1)
+    await app.start()
+
+    traffic = Traffic(api, video_ids)
+    started = time.monotonic()
+    for i in range(args.users):
+        traffic.start_user(i + 1, subscribed=random.random() >= args.unsubscribed)
+        if args.arrival_rate:
+            await asyncio.sleep(1 / args.arrival_rate)
+    for i in range(args.admins):
+        traffic.start_admin(ADMIN_BASE_ID + i, args.admin_files, args.admin_albums)
+
+    timed_out = False
+    try:
+        await asyncio.wait_for(traffic.completed.wait(), timeout=args.timeout)
+    except asyncio.TimeoutError:
+        timed_out = True
+    elapsed = time.monotonic() - started
+
+    # Same order as Application.run_polling
+    await app.updater.stop()
+    await app.stop()
+    await bitlu.post_stop(app)
+    await app.shutdown()
+    await bitlu.post_shutdown(app)
+    await api.stop()
+
+    deliveries = traffic.latencies["delivery"] + traffic.latencies["verify_delivery"]
+    return {
+        "users": args.users,
+        "admins": args.admins,
+        "concurrency": args.concurrency,
+        "delivery_mode": args.delivery_mode,
+        "elapsed_s": round(elapsed, 3),
+        "timed_out": timed_out,
+        "incomplete_flows": len(traffic.pending),
+        "updates": traffic.updates_sent,
+        "updates_per_sec": round(traffic.updates_sent / elapsed, 1),
+        "deliveries": len(deliveries),
+        "api_calls_per_delivery": round(traffic.user_calls / max(len(deliveries), 1), 2),
+        "api_calls": dict(sorted(api.calls.items())),
+        "injected_429": api.floods,
+        "delivery_latency_s": {
+            "p50": round(percentile(deliveries, 0.50), 4),
+            "p95": round(percentile(deliveries, 0.95), 4),
+            "p99": round(percentile(deliveries, 0.99), 4),
+        },
+        "addvideo_latency_s": {
+            "p50": round(percentile(traffic.latencies["addvideo"], 0.50), 4),
+            "p99": round(percentile(traffic.latencies["addvideo"], 0.99), 4),
+        },
+    }
+
+
+def check_gates(result: dict, args) -> list:
+    failures = []
+    if result["timed_out"]:
+        failures.append(f"{result['incomplete_flows']} flows did not complete in {args.timeout}s")
+    if args.min_updates_per_sec and result["updates_per_sec"] < args.min_updates_per_sec:
+        failures.append(f"updates/sec {result['updates_per_sec']} < {args.min_updates_per_sec}")
+    if args.max_p99 and result["delivery_latency_s"]["p99"] > args.max_p99:
+        failures.append(f"delivery p99 {result['delivery_latency_s']['p99']}s > {args.max_p99}s")
+    if args.max_calls_per_delivery and result["api_calls_per_delivery"] > args.max_calls_per_delivery:
+        failures.append(
+            f"API calls per delivery {result['api_calls_per_delivery']} > {args.max_calls_per_delivery}"
+        )
+    return failures
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000, help="users opening a deep link")
+    parser.add_argument("--unsubscribed", type=float, default=0.2, help="share of users who must join first")
+    parser.add_argument("--admins", type=int, default=5, help="concurrent /addvideo sessions")
+    parser.add_argument("--admin-files", type=int, default=5, help="files per /addvideo session")
+    parser.add_argument("--admin-albums", action="store_true", help="admins forward their files as one album")
+    parser.add_argument("--channels", type=int, default=1, help="force-subscribe channels to check")
+    parser.add_argument("--videos", type=int, default=50, help="titles in the seeded catalog")
+    parser.add_argument("--files", type=int, default=6, help="files per seeded title")
+    parser.add_argument("--arrival-rate", type=float, default=0, help="users/sec, 0 = all at once")
+    parser.add_argument("--latency", type=float, default=0.02, help="fake API latency (s)")
+    parser.add_argument("--jitter", type=float, default=0.01, help="fake API latency jitter (s)")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="probability of a 429 on sends")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after of injected 429s")
+    parser.add_argument("--concurrency", type=int, default=32, help="CONCURRENT_UPDATES")
+    parser.add_argument("--delivery-mode", default="album", choices=["album", "single"])
+    parser.add_argument(
+        "--global-rate", type=float, default=1000,
+        help="GLOBAL_RATE_LIMIT msg/s (30 models Telegram, the default measures the bot itself)",
+    )
+    parser.add_argument("--chat-rate", type=float, default=1, help="CHAT_RATE_LIMIT msg/s")
+    parser.add_argument("--timeout", type=float, default=300, help="give up after this many seconds")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--min-updates-per-sec", type=float, default=0)
+    parser.add_argument("--max-p99", type=float, default=0, help="max delivery p99 latency (s)")
+    parser.add_argument("--max-calls-per-delivery", type=float, default=0)
+    parser.add_argument("--json", action="store_true", help="print the result as JSON only")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    logging.basicConfig(level=logging.WARNING)
+    result = asyncio.run(run(args))
+
+    failures = check_gates(result, args)
+    if args.json:
+        print(json.dumps({**result, "failures": failures}, indent=2))
+    else:
+        print(f"Users: {result['users']}  Admin sessions: {result['admins']}  "
+              f"Concurrency: {result['concurrency']}  Mode: {result['delivery_mode']}")
+        print(f"Elapsed: {result['elapsed_s']}s  Updates: {result['updates']} "
+              f"({result['updates_per_sec']}/s)")
+        print(f"Deliveries: {result['deliveries']}  API calls/delivery: {result['api_calls_per_delivery']}  "
+              f"Injected 429s: {result['injected_429']}")
+        latency = result["delivery_latency_s"]
+        print(f"Delivery latency p50/p95/p99: {latency['p50']}s / {latency['p95']}s / {latency['p99']}s")
+        print(f"/addvideo latency p50/p99: {result['addvideo_latency_s']['p50']}s / "
+              f"{result['addvideo_latency_s']['p99']}s")
+        print("API calls:", ", ".join(f"{k}={v}" for k, v in result["api_calls"].items()))
+        for failure in failures:
+            print("FAIL:", failure)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
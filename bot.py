@@ -1,41 +1,2775 @@
 import logging
+import logging.handlers
+import argparse
+import atexit
 import asyncio
+import codecs
 import datetime
 import json
 import os
+import queue
+import re
 import time
+import bisect
+import functools
+import heapq
+import itertools
+import secrets
+import signal
+import socket
+import sqlite3
+import sys
+import threading
 import traceback
+from collections import OrderedDict, deque
 from typing import Optional
 
+import httpx
 from telegram import (
     Update,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
+    InlineQueryResultArticle,
+    InlineQueryResultCachedPhoto,
+    InputTextMessageContent,
+    InputMediaAudio,
+    InputMediaDocument,
+    InputMediaPhoto,
+    InputMediaVideo,
 )
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
+    ChatMemberHandler,
     ContextTypes,
+    InlineQueryHandler,
     filters,
 )
-from telegram.error import BadRequest, TelegramError
+from telegram.ext import BaseRateLimiter, BaseUpdateProcessor
+from telegram.helpers import escape_markdown
+from telegram.request import HTTPXRequest
+from telegram.error import (
+    BadRequest,
+    Forbidden,
+    NetworkError,
+    RetryAfter,
+    TelegramError,
+    TimedOut,
+)
+
+# ================== BOT CONFIGURATION ==================
+BOT_TOKEN = os.environ.get("BOT_TOKEN", "8327527686:AAFgeRamSxQudV0IKOSh9xUlJs3IsGbL3Xs")
+ADMIN_IDS = [int(x) for x in os.environ.get("ADMIN_IDS", "6532419818").split(",")]
+# Comma-separated @usernames or numeric ids; users must join every one of them
+FORCE_SUB_CHANNELS = [
+    channel.strip() for channel in os.environ.get("FORCE_SUB_CHANNEL", "@gullymovies").split(",") if channel.strip()
+]
+# Point at a self-hosted Bot API server (or the benchmark's fake one) instead of Telegram
+BOT_API_URL = os.environ.get("BOT_API_URL", "https://api.telegram.org/bot")
+
+# Membership cache - seconds a "joined" / "not joined" answer is trusted
+SUB_CACHE_POSITIVE_TTL = int(os.environ.get("SUB_CACHE_POSITIVE_TTL", "600"))
+SUB_CACHE_NEGATIVE_TTL = int(os.environ.get("SUB_CACHE_NEGATIVE_TTL", "20"))
+SUB_CACHE_MAX_SIZE = int(os.environ.get("SUB_CACHE_MAX_SIZE", "50000"))
+# Membership checks for all channels run concurrently; unanswered ones count as not joined
+SUB_CHECK_TIMEOUT = float(os.environ.get("SUB_CHECK_TIMEOUT", "5"))
+
+# "album" groups files into send_media_group calls, "single" sends one message per file
+DELIVERY_MODE = os.environ.get("DELIVERY_MODE", "album").lower()
+
+# Updates handled in parallel (different users only, each user's updates stay in order)
+CONCURRENT_UPDATES = int(os.environ.get("CONCURRENT_UPDATES", "32"))
+
+# Webhook mode - enabled when WEBHOOK_URL is set, polling otherwise
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "telegram").strip("/")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")
+WEBHOOK_MAX_CONNECTIONS = int(os.environ.get("WEBHOOK_MAX_CONNECTIONS", "40"))
+PORT = int(os.environ.get("PORT", "8080"))
+# Health endpoint (GET /healthz) - on by default in webhook mode
+HEALTH_PORT = int(os.environ.get("HEALTH_PORT", "8081" if WEBHOOK_URL else "0"))
+# Prometheus /metrics - off when METRICS_PORT is 0, otherwise served on its own server bound to
+# METRICS_HOST. Setting it equal to HEALTH_PORT opts in to sharing the public health server instead.
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+# Seconds in-flight handlers get to finish on shutdown before they are cancelled
+DRAIN_TIMEOUT = float(os.environ.get("DRAIN_TIMEOUT", "25"))
+
+# Storage - "sqlite" (default), "json" (legacy single-file catalog) or "redis" (shared by replicas)
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "sqlite").lower()
+DATA_FILE = os.environ.get("DATA_FILE", "videos_data.json")
+DB_PATH = os.environ.get("DB_PATH", "bitlu_mawa.db")
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+REDIS_PREFIX = os.environ.get("REDIS_PREFIX", "bitlu:")
+# Identifies this process in shared locks - replicas must not share it
+REPLICA_ID = os.environ.get("REPLICA_ID") or f"{socket.gethostname()}-{os.getpid()}"
+# Seconds a replica's claim on a delivery/broadcast survives without a refresh
+SHARED_LOCK_TTL = int(os.environ.get("SHARED_LOCK_TTL", "120"))
+# Seconds an update id is remembered so a webhook retry hitting another replica is dropped
+UPDATE_DEDUP_TTL = int(os.environ.get("UPDATE_DEDUP_TTL", "3600"))
+
+# Delivery queue - worker pool size and retry policy for transient send errors
+DELIVERY_WORKERS = int(os.environ.get("DELIVERY_WORKERS", "64"))
+DELIVERY_MAX_ATTEMPTS = int(os.environ.get("DELIVERY_MAX_ATTEMPTS", "5"))
+DELIVERY_RETRY_BASE = float(os.environ.get("DELIVERY_RETRY_BASE", "2"))
+# Re-requesting a title within this many seconds of receiving it gets a short reply, not a resend
+DELIVERY_COOLDOWN = int(os.environ.get("DELIVERY_COOLDOWN", "300"))
+DELIVERY_COOLDOWN_SIZE = int(os.environ.get("DELIVERY_COOLDOWN_SIZE", "100000"))
+# Compiled delivery plans kept in memory (two per title at most: with and without poster)
+DELIVERY_PLAN_CACHE_SIZE = int(os.environ.get("DELIVERY_PLAN_CACHE_SIZE", "1024"))
+# Deliveries with at least this many send calls get a live progress message
+PROGRESS_MIN_BATCHES = int(os.environ.get("PROGRESS_MIN_BATCHES", "3"))
+PROGRESS_INTERVAL = float(os.environ.get("PROGRESS_INTERVAL", "3"))
+
+# /stats counters - how often they are written back to the store, and how many titles to rank
+COUNTERS_FLUSH_INTERVAL = float(os.environ.get("COUNTERS_FLUSH_INTERVAL", "30"))
+STATS_TOP_N = int(os.environ.get("STATS_TOP_N", "5"))
+
+# /listvideos page size and /find result cap
+LIST_PAGE_SIZE = int(os.environ.get("LIST_PAGE_SIZE", "10"))
+FIND_MAX_RESULTS = int(os.environ.get("FIND_MAX_RESULTS", "20"))
+
+# Inline mode (@bot <query>) - Telegram-side cache seconds, matches kept per query, LRU size
+INLINE_CACHE_TIME = int(os.environ.get("INLINE_CACHE_TIME", "300"))
+INLINE_MAX_RESULTS = int(os.environ.get("INLINE_MAX_RESULTS", "200"))
+INLINE_QUERY_CACHE_SIZE = int(os.environ.get("INLINE_QUERY_CACHE_SIZE", "1024"))
+INLINE_PAGE_SIZE = 50  # Telegram's maximum per answer
+
+# /addvideo drafts - idle seconds before a draft is dropped, sweep interval, hard cap
+SESSION_TTL = int(os.environ.get("SESSION_TTL", "3600"))
+SESSION_SWEEP_INTERVAL = int(os.environ.get("SESSION_SWEEP_INTERVAL", "60"))
+SESSION_MAX = int(os.environ.get("SESSION_MAX", "200"))
+
+# Albums forwarded to /addvideo - seconds of quiet that end a media group, finish the title on completion
+ALBUM_DEBOUNCE = float(os.environ.get("ALBUM_DEBOUNCE", "1.5"))
+ALBUM_AUTO_FINISH = os.environ.get("ALBUM_AUTO_FINISH", "").lower() in ("1", "true", "yes")
+
+# /broadcast - concurrent senders, users per checkpointed page, seconds between progress edits
+BROADCAST_WORKERS = int(os.environ.get("BROADCAST_WORKERS", "64"))
+BROADCAST_PAGE_SIZE = int(os.environ.get("BROADCAST_PAGE_SIZE", "500"))
+BROADCAST_PROGRESS_INTERVAL = float(os.environ.get("BROADCAST_PROGRESS_INTERVAL", "5"))
+# Recently seen user ids kept in memory so repeat /start calls skip the user table write
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "100000"))
+
+# Send scheduler - Telegram allows ~30 msg/s bot-wide, ~1 msg/s per private chat, 20 msg/min per group
+GLOBAL_RATE_LIMIT = float(os.environ.get("GLOBAL_RATE_LIMIT", "30"))
+CHAT_RATE_LIMIT = float(os.environ.get("CHAT_RATE_LIMIT", "1"))
+CHAT_BURST = int(os.environ.get("CHAT_BURST", "3"))
+GROUP_RATE_LIMIT = float(os.environ.get("GROUP_RATE_LIMIT", "20")) / 60
+RATE_LIMIT_MAX_RETRIES = int(os.environ.get("RATE_LIMIT_MAX_RETRIES", "3"))
+
+# HTTP transport for bot calls (sends, membership checks...), defaults match PTB's. HTTP_KEEPALIVE
+# is the number of idle connections kept open (0 turns keep-alive off); HTTP_VERSION "2" needs
+# the http2 extra. Watch bitlu_http_pool_wait_seconds before shrinking the pool: membership
+# checks queue behind sends and count as "not joined" after SUB_CHECK_TIMEOUT.
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", "256"))
+HTTP_KEEPALIVE = int(os.environ.get("HTTP_KEEPALIVE", str(HTTP_POOL_SIZE)))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", "5"))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", "5"))
+HTTP_WRITE_TIMEOUT = float(os.environ.get("HTTP_WRITE_TIMEOUT", "5"))
+HTTP_POOL_TIMEOUT = float(os.environ.get("HTTP_POOL_TIMEOUT", "1"))
+HTTP_VERSION = os.environ.get("HTTP_VERSION", "1.1")
+# Same settings for the getUpdates long poll, which only ever needs one connection.
+# The read timeout is on top of the long-poll timeout.
+UPDATES_POOL_SIZE = int(os.environ.get("UPDATES_POOL_SIZE", "1"))
+UPDATES_KEEPALIVE = int(os.environ.get("UPDATES_KEEPALIVE", str(UPDATES_POOL_SIZE)))
+UPDATES_KEEPALIVE_EXPIRY = float(os.environ.get("UPDATES_KEEPALIVE_EXPIRY", "5"))
+UPDATES_CONNECT_TIMEOUT = float(os.environ.get("UPDATES_CONNECT_TIMEOUT", "5"))
+UPDATES_READ_TIMEOUT = float(os.environ.get("UPDATES_READ_TIMEOUT", "5"))
+UPDATES_WRITE_TIMEOUT = float(os.environ.get("UPDATES_WRITE_TIMEOUT", "5"))
+UPDATES_POOL_TIMEOUT = float(os.environ.get("UPDATES_POOL_TIMEOUT", "1"))
+UPDATES_HTTP_VERSION = os.environ.get("UPDATES_HTTP_VERSION", "1.1")
+
+# Logging - "text" or "json" lines on stderr, written by a background thread.
+# INFO lines from any one call site are capped at LOG_SAMPLE_PER_SECOND (0 keeps them all).
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text").lower()
+LOG_SAMPLE_PER_SECOND = int(os.environ.get("LOG_SAMPLE_PER_SECOND", "20"))
+
+videos_data = {}
+
+# ================== LOGGER ==================
+class LogSampler(logging.Filter):
+    """Drops INFO-and-below records beyond `per_second` per call site.
+
+    The call site (file and line) stands for the message type, so a hot line
+    like "Checking subscription for user %s" is thinned out under load while
+    rare lines always get through. Warnings and errors are never dropped,
+    and a dropped record with %-style arguments is never formatted.
+    """
+
+    def __init__(self, per_second: int) -> None:
+        super().__init__()
+        self.per_second = per_second
+        self._windows = {}  # (pathname, lineno) -> [second, records seen]
+        self.dropped = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not self.per_second or record.levelno > logging.INFO:
+            return True
+        second = int(time.monotonic())
+        window = self._windows.get((record.pathname, record.lineno))
+        if window is None or window[0] != second:
+            self._windows[(record.pathname, record.lineno)] = [second, 1]
+            return True
+        window[1] += 1
+        if window[1] <= self.per_second:
+            return True
+        self.dropped += 1
+        return False
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread.
+
+    The stock handler renders the message before queueing it so records can
+    be pickled; ours stay in-process, so the caller only pays for the put.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class JSONLogFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def setup_logging() -> Optional[logging.handlers.QueueListener]:
+    """Route log records through a queue to a stderr writer thread.
+
+    Like basicConfig, leaves an already configured root logger alone.
+    """
+    root = logging.getLogger()
+    if root.handlers:
+        return None
+    root.setLevel(LOG_LEVEL)
+
+    stream = logging.StreamHandler()
+    if LOG_FORMAT == "json":
+        stream.setFormatter(JSONLogFormatter())
+    else:
+        stream.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+
+    records = queue.SimpleQueue()
+    handler = DeferredQueueHandler(records)
+    handler.addFilter(log_sampler)
+    root.addHandler(handler)
+    listener = logging.handlers.QueueListener(records, stream, respect_handler_level=True)
+    listener.start()
+    # Flushes what is still queued when the process exits
+    atexit.register(listener.stop)
+    return listener
+
+
+log_sampler = LogSampler(LOG_SAMPLE_PER_SECOND)
+log_listener = setup_logging()
+logger = logging.getLogger(__name__)
+
+# ================== MEMBERSHIP CACHE ==================
+class MembershipCache:
+    """LRU cache of force-sub membership answers with separate TTLs for yes/no.
+
+    Keys are ``(user_id, channel)`` pairs.
+    """
+
+    def __init__(self, positive_ttl: int, negative_ttl: int, max_size: int) -> None:
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()  # (user_id, channel) -> (is_member, expires_at)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: tuple) -> Optional[bool]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        is_member, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return is_member
+
+    def peek(self, key: tuple) -> Optional[bool]:
+        """Like `get` without counting a hit or miss or refreshing the LRU order"""
+        entry = self._entries.get(key)
+        if entry is None or entry[1] <= time.monotonic():
+            return None
+        return entry[0]
+
+    def put(self, key: tuple, is_member: bool) -> None:
+        ttl = self.positive_ttl if is_member else self.negative_ttl
+        if ttl <= 0:
+            self._entries.pop(key, None)
+            return
+
+        self._entries[key] = (is_member, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: tuple) -> None:
+        self._entries.pop(key, None)
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hit_rate(),
+        }
+
+
+def force_sub_channel_of(chat) -> Optional[str]:
+    """The FORCE_SUB_CHANNELS entry naming `chat` (as @username or numeric id), if any."""
+    for channel in FORCE_SUB_CHANNELS:
+        if channel.startswith("@"):
+            if chat.username and chat.username.lower() == channel[1:].lower():
+                return channel
+        elif str(chat.id) == channel:
+            return channel
+    return None
+
+
+# ================== LRU CACHE ==================
+class LRUCache:
+    """Bounded mapping that evicts the least recently used entry."""
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        try:
+            value = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value) -> None:
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def pop(self, key) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# ================== LATENCY ==================
+def percentile(samples, q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+class LatencyRecorder:
+    """Keeps the most recent samples (seconds) for percentile reporting."""
+
+    def __init__(self, maxlen: int = 2048) -> None:
+        self.samples = deque(maxlen=maxlen)
+        self.count = 0
+
+    def record(self, seconds: float) -> None:
+        self.samples.append(seconds)
+        self.count += 1
+
+    def percentile(self, q: float) -> float:
+        return percentile(self.samples, q)
+
+
+# ================== METRICS ==================
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    pairs = []
+    for key, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{key}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Metric:
+    def __init__(self, name: str, help_text: str, kind: str, fn=None) -> None:
+        self.name = name
+        self.help = help_text
+        self.kind = kind
+        self.fn = fn  # callable returning the value at scrape time
+        self.values = {}  # tuple(sorted(labels.items())) -> value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def total(self) -> float:
+        return sum(self.values.values())
+
+    def samples(self):
+        if self.fn is not None:
+            return [(self.name, {}, self.fn())]
+        return [(self.name, dict(key), value) for key, value in self.values.items()]
+
+
+class Histogram(Metric):
+    def __init__(self, name: str, help_text: str, buckets=LATENCY_BUCKETS) -> None:
+        super().__init__(name, help_text, "histogram")
+        self.buckets = buckets
+        self.series = {}  # label key -> [count per bucket..., sum, count]
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def mean(self, **labels) -> Optional[float]:
+        series = self.series.get(tuple(sorted(labels.items())))
+        return series[-2] / series[-1] if series else None
+
+    def samples(self):
+        out = []
+        for key, series in self.series.items():
+            labels = dict(key)
+            for bound, count in zip(self.buckets, series):
+                out.append((f"{self.name}_bucket", {**labels, "le": str(bound)}, count))
+            out.append((f"{self.name}_bucket", {**labels, "le": "+Inf"}, series[-1]))
+            out.append((f"{self.name}_sum", labels, series[-2]))
+            out.append((f"{self.name}_count", labels, series[-1]))
+        return out
+
+
+class MetricsRegistry:
+    """Tiny Prometheus text-format registry, so no client library is needed."""
+
+    def __init__(self) -> None:
+        self._metrics = {}
+
+    def _register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, fn=None) -> Metric:
+        return self._register(Metric(name, help_text, "counter", fn))
+
+    def gauge(self, name: str, help_text: str, fn=None) -> Metric:
+        return self._register(Metric(name, help_text, "gauge", fn))
+
+    def histogram(self, name: str, help_text: str, buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                logger.error(f"Error collecting metric {metric.name}: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+HANDLER_LATENCY = metrics.histogram(
+    "bitlu_handler_duration_seconds", "Time spent in bot handlers and delivery methods"
+)
+HANDLER_ERRORS = metrics.counter("bitlu_handler_errors_total", "Exceptions escaping handlers")
+API_CALLS = metrics.counter("bitlu_api_calls_total", "Bot API calls by method")
+API_ERRORS = metrics.counter("bitlu_api_errors_total", "Failed Bot API calls by method and error")
+RETRY_AFTER = metrics.counter("bitlu_retry_after_total", "RetryAfter (HTTP 429) responses by method")
+DUPLICATE_DELIVERIES = metrics.counter(
+    "bitlu_delivery_duplicates_total", "Delivery requests answered without a new delivery, by reason"
+)
+POOL_WAIT = metrics.histogram(
+    "bitlu_http_pool_wait_seconds", "Time requests waited for a pooled HTTP connection, by pool",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+POOL_TIMEOUTS = metrics.counter(
+    "bitlu_http_pool_timeouts_total", "Requests dropped because no pooled connection freed up, by pool"
+)
+
+
+def instrumented(name: str):
+    """Record the duration (and escaping errors) of an async handler under `name`."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.monotonic()
+            try:
+                return await func(*args, **kwargs)
+            except Exception as e:
+                HANDLER_ERRORS.inc(handler=name, error=type(e).__name__)
+                raise
+            finally:
+                HANDLER_LATENCY.observe(time.monotonic() - started, handler=name)
+
+        return wrapper
+
+    return decorator
+
+
+# ================== UPDATE PROCESSING ==================
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Runs updates concurrently while keeping each user's updates in arrival order.
+
+    Multi-step flows such as the /addvideo wizard rely on a user's messages
+    being handled one after another; different users never wait on each
+    other beyond the ``max_concurrent_updates`` cap. With `claim` set, an
+    update is only handled if ``await claim(update)`` is true, which lets
+    replicas behind one webhook drop retries another replica already took.
+    """
+
+    def __init__(self, max_concurrent_updates: int, claim=None) -> None:
+        super().__init__(max_concurrent_updates)
+        self._locks = {}  # ordering key -> [asyncio.Lock, users of the lock]
+        self._tasks = set()
+        self._claim = claim
+        self.latency = LatencyRecorder()
+        self.in_flight = 0
+        self.duplicates = 0
+
+    @staticmethod
+    def ordering_key(update: object):
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user:
+            return update.effective_user.id
+        if update.effective_chat:
+            return update.effective_chat.id
+        return None
+
+    async def process_update(self, update: object, coroutine) -> None:
+        # The base class takes a concurrency slot before do_process_update, so an
+        # update waiting on its user's lock would hold one; a single busy user
+        # could then fill every slot. Queue on the user's lock first instead.
+        started = time.monotonic()
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        key = self.ordering_key(update)
+        try:
+            if key is None:
+                async with self._semaphore:
+                    await self.do_process_update(update, coroutine)
+                return
+
+            entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+            entry[1] += 1
+            try:
+                async with entry[0], self._semaphore:
+                    await self.do_process_update(update, coroutine)
+            finally:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[key]
+        finally:
+            self._tasks.discard(task)
+            self.latency.record(time.monotonic() - started)
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        if self._claim and not await self._claim(update):
+            coroutine.close()
+            self.duplicates += 1
+            return
+
+        self.in_flight += 1
+        try:
+            await coroutine
+        finally:
+            self.in_flight -= 1
+
+    def cancel_in_flight(self) -> None:
+        if self._tasks:
+            logger.warning(f"Drain timeout reached, cancelling {len(self._tasks)} in-flight updates")
+        for task in list(self._tasks):
+            task.cancel()
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "processed": self.latency.count,
+            "p50": self.latency.percentile(0.5),
+            "p99": self.latency.percentile(0.99),
+        }
+
+
+# ================== OPS HTTP SERVER ==================
+class OpsServer:
+    """Minimal HTTP/1.1 server for operational endpoints such as /healthz.
+
+    Route handlers take no arguments and return ``(status, content_type, body)``.
+    """
+
+    REASONS = {200: "OK", 404: "Not Found", 405: "Method Not Allowed", 503: "Service Unavailable"}
+
+    def __init__(self, host: str, port: int) -> None:
+        self.host = host
+        self.port = port
+        self.routes = {}
+        self._server = None
+
+    def route(self, path: str, handler) -> None:
+        self.routes[path] = handler
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"Ops server listening on {self.host}:{self.port}")
+
+    async def stop(self) -> None:
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+                pass
+
+            parts = request_line.decode("latin-1").split()
+            method, path = (parts[0], parts[1].split("?")[0]) if len(parts) >= 2 else ("", "")
+            handler = self.routes.get(path)
+            if handler is None:
+                status, content_type, body = 404, "text/plain", "not found\n"
+            elif method not in ("GET", "HEAD"):
+                status, content_type, body = 405, "text/plain", "method not allowed\n"
+            else:
+                status, content_type, body = handler()
+
+            payload = body.encode("utf-8")
+            head = (
+                f"HTTP/1.1 {status} {self.REASONS.get(status, '')}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(payload)}\r\n"
+                "Connection: close\r\n\r\n"
+            )
+            writer.write(head.encode("latin-1") + (payload if method != "HEAD" else b""))
+            await writer.drain()
+        except Exception as e:
+            logger.error(f"Ops server error: {e}")
+        finally:
+            writer.close()
+
+
+# ================== HTTP TRANSPORT ==================
+class PooledRequest(HTTPXRequest):
+    """HTTPXRequest with keep-alive control and pool-wait measurement.
+
+    The wait is the time from handing a request to httpx until httpcore
+    reports its first event on a connection (connecting, or sending headers
+    on a reused one). High waits with normal API latency mean the pool is
+    too small; normal waits with high latency mean Telegram is slow.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        pool_size: int,
+        keepalive: int,
+        keepalive_expiry: float,
+        connect_timeout: float,
+        read_timeout: float,
+        write_timeout: float,
+        pool_timeout: float,
+        http_version: str,
+    ) -> None:
+        self.name = name
+        super().__init__(
+            connection_pool_size=pool_size,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            write_timeout=write_timeout,
+            pool_timeout=pool_timeout,
+            http_version=http_version,
+        )
+        self._client_kwargs["limits"] = httpx.Limits(
+            max_connections=pool_size,
+            max_keepalive_connections=min(keepalive, pool_size),
+            keepalive_expiry=keepalive_expiry,
+        )
+        self._client_kwargs["event_hooks"] = {"request": [self._start_pool_timer]}
+        self._client = self._build_client()
+
+    async def _start_pool_timer(self, request: httpx.Request) -> None:
+        queued = time.monotonic()
+        timed = False
+
+        async def trace(event_name: str, info: dict) -> None:
+            nonlocal timed
+            if not timed:
+                timed = True
+                POOL_WAIT.observe(time.monotonic() - queued, pool=self.name)
+
+        request.extensions["trace"] = trace
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        try:
+            return await super().do_request(url, method, *args, **kwargs)
+        except TimedOut as e:
+            if isinstance(e.__cause__, httpx.PoolTimeout):
+                POOL_TIMEOUTS.inc(pool=self.name)
+            raise
+
+
+# ================== SEND SCHEDULER ==================
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+# File sends are bulk traffic and may wait behind replies to button taps and commands
+BULK_ENDPOINTS = {
+    "sendVideo", "sendDocument", "sendAudio", "sendPhoto", "sendMediaGroup",
+    "copyMessage", "forwardMessage",
+}
+
+
+def is_metered_endpoint(endpoint: str) -> bool:
+    """Only calls that post or edit messages count against Telegram's flood limits."""
+    return endpoint.startswith(("send", "copy", "forward", "edit"))
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, cost: float) -> float:
+        """Seconds until `cost` tokens are available (0 if they are now)."""
+        self._refill(time.monotonic())
+        missing = min(cost, self.capacity) - self.tokens
+        return missing / self.rate if missing > 0 else 0.0
+
+    def reserve(self, cost: float) -> float:
+        """Take `cost` tokens, going into debt if needed; returns how long to wait."""
+        self._refill(time.monotonic())
+        self.tokens -= cost
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def is_idle(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+class SendScheduler(BaseRateLimiter):
+    """Rate limiter that every Bot API call made through ``ExtBot`` passes through.
+
+    Metered calls first wait on a per-chat token bucket, then queue for the
+    bot-wide bucket where interactive traffic is served before bulk file
+    sends. ``RetryAfter`` pauses all metered traffic for the requested time
+    and the request is retried. ``rate_limit_args`` may carry an explicit
+    ``PRIORITY_*`` value, otherwise the priority is derived from the endpoint.
+    """
+
+    MAX_CHAT_BUCKETS = 10000
+
+    def __init__(
+        self,
+        global_rate: float = GLOBAL_RATE_LIMIT,
+        chat_rate: float = CHAT_RATE_LIMIT,
+        chat_burst: int = CHAT_BURST,
+        group_rate: float = GROUP_RATE_LIMIT,
+        max_retries: int = RATE_LIMIT_MAX_RETRIES,
+    ) -> None:
+        self._global = TokenBucket(global_rate, max(global_rate, 1))
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._group_rate = group_rate
+        self._max_retries = max_retries
+        self._chats = OrderedDict()  # chat_id -> TokenBucket
+        self._queue = []  # heap of (priority, seq, cost, future)
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._paused_until = 0.0
+        self._dispatcher = None
+
+        self.retry_after_count = 0
+        self.waits = {PRIORITY_INTERACTIVE: deque(maxlen=1000), PRIORITY_BULK: deque(maxlen=1000)}
+        self.max_wait = 0.0
+        self.requests = 0
+
+    async def initialize(self) -> None:
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self) -> None:
+        if self._dispatcher:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+        while self._queue:
+            _, _, _, future = heapq.heappop(self._queue)
+            if not future.done():
+                future.cancel()
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            rate = self._group_rate if is_group else self._chat_rate
+            bucket = self._chats[chat_id] = TokenBucket(rate, self._chat_burst)
+            if len(self._chats) > self.MAX_CHAT_BUCKETS:
+                # Drop chats whose buckets have refilled, they carry no state
+                for key in [k for k, b in self._chats.items() if b.is_idle()]:
+                    del self._chats[key]
+        self._chats.move_to_end(chat_id)
+        return bucket
+
+    async def _dispatch(self) -> None:
+        while True:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+
+            _, _, cost, future = self._queue[0]
+            delay = self._global.delay(cost)
+            if delay > 0:
+                # Re-check the head afterwards, a higher priority request may have arrived
+                await asyncio.sleep(delay)
+                continue
+
+            heapq.heappop(self._queue)
+            if not future.done():
+                self._global.reserve(cost)
+                future.set_result(None)
+
+    async def _acquire(self, chat_id, cost: float, priority: int) -> None:
+        if chat_id is not None:
+            wait = self._chat_bucket(chat_id).reserve(1)
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._seq), cost, future))
+        self._wakeup.set()
+        await future
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        self.requests += 1
+        API_CALLS.inc(method=endpoint)
+        try:
+            return await self._process(callback, args, kwargs, endpoint, data, rate_limit_args)
+        except TelegramError as e:
+            API_ERRORS.inc(method=endpoint, error=type(e).__name__)
+            raise
+
+    async def _process(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if not is_metered_endpoint(endpoint):
+            return await callback(*args, **kwargs)
+
+        if rate_limit_args is not None:
+            priority = rate_limit_args
+        else:
+            priority = PRIORITY_BULK if endpoint in BULK_ENDPOINTS else PRIORITY_INTERACTIVE
+        chat_id = data.get("chat_id")
+        if isinstance(chat_id, str) and chat_id.lstrip("-").isdigit():
+            chat_id = int(chat_id)
+        cost = len(data.get("media") or ()) or 1
+
+        for attempt in range(self._max_retries + 1):
+            queued_at = time.monotonic()
+            await self._acquire(chat_id, cost, priority)
+            waited = time.monotonic() - queued_at
+            self.waits[priority].append(waited)
+            self.max_wait = max(self.max_wait, waited)
+
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                self.retry_after_count += 1
+                RETRY_AFTER.inc(method=endpoint)
+                if attempt == self._max_retries:
+                    raise
+                logger.warning(f"Flood limit on {endpoint}, pausing sends for {e.retry_after}s")
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after + 0.1)
+
+    def stats(self) -> dict:
+        p = percentile
+        interactive = self.waits[PRIORITY_INTERACTIVE]
+        bulk = self.waits[PRIORITY_BULK]
+        return {
+            "queue_depth": len(self._queue),
+            "requests": self.requests,
+            "retry_after": self.retry_after_count,
+            "interactive_wait_p50": p(interactive, 0.5),
+            "interactive_wait_p99": p(interactive, 0.99),
+            "bulk_wait_p50": p(bulk, 0.5),
+            "bulk_wait_p99": p(bulk, 0.99),
+            "max_wait": self.max_wait,
+        }
+
+
+# ================== STORAGE ==================
+# Optional per-file metadata kept next to type and file_id
+FILE_METADATA = ("size", "duration", "mime_type", "file_name")
+
+
+def file_key(f: dict) -> str:
+    """Identity of a stored file: its file_unique_id when known.
+
+    Files stored before unique ids were kept, and imported copies, fall back
+    to type and file_id.
+    """
+    return f.get("uid") or f"{f['type']}:{f['file_id']}"
+
+
+class VideoStore:
+    """Persistence backend for the video catalog and small bot state records.
+
+    Records are JSON-serializable dicts grouped by namespace (e.g. delivery
+    jobs). Methods are blocking and are called from worker threads via
+    ``asyncio.to_thread``; implementations must be thread-safe.
+    """
+
+    def load_all(self) -> dict:
+        raise NotImplementedError
+
+    def upsert_video(self, video_id: str, video: dict) -> None:
+        raise NotImplementedError
+
+    def upsert_videos(self, videos: dict) -> None:
+        for video_id, video in videos.items():
+            self.upsert_video(video_id, video)
+
+    def delete_video(self, video_id: str) -> None:
+        raise NotImplementedError
+
+    def load_records(self, namespace: str) -> dict:
+        raise NotImplementedError
+
+    def put_record(self, namespace: str, key: str, value: dict) -> None:
+        raise NotImplementedError
+
+    def delete_record(self, namespace: str, key: str) -> None:
+        raise NotImplementedError
+
+    # Counters such as feedback taps: {key: {name: count}} per namespace. The
+    # default keeps each key as a record; backends with atomic increments
+    # override both so concurrent writers never lose counts.
+    def add_counts(self, namespace: str, deltas: dict) -> None:
+        for key, counts in deltas.items():
+            record = self.get_record(namespace, key) or {}
+            for name, n in counts.items():
+                record[name] = record.get(name, 0) + n
+            self.put_record(namespace, key, record)
+
+    def load_counts(self, namespace: str) -> dict:
+        return self.load_records(namespace)
+
+    def delete_counts(self, namespace: str, key: str, names: list) -> None:
+        record = self.get_record(namespace, key)
+        if record is not None:
+            for name in names:
+                record.pop(name, None)
+            self.put_record(namespace, key, record)
+
+    def get_video(self, video_id: str) -> Optional[dict]:
+        return self.load_all().get(video_id)
+
+    def get_record(self, namespace: str, key: str) -> Optional[dict]:
+        return self.load_records(namespace).get(key)
+
+    # Coordination between replicas. A local backend serves one process whose
+    # in-memory structures already serialize the work, so its locks always
+    # succeed and the shared cache and catalog channel are no-ops.
+    shared = False
+
+    def acquire_lock(self, name: str, owner: str, ttl: float) -> bool:
+        """Take or refresh lock `name` for `owner`, False while someone else holds it"""
+        return True
+
+    def release_lock(self, name: str, owner: str) -> None:
+        pass
+
+    def cache_get_many(self, keys: list) -> list:
+        return [None] * len(keys)
+
+    def cache_set(self, key: str, value, ttl: float) -> None:
+        pass
+
+    def cache_delete(self, key: str) -> None:
+        pass
+
+    async def listen(self, channel: str, callback) -> None:
+        """Await `callback(event)` for catalog changes made by other replicas"""
+
+    # Users who started the bot. Backends without a dedicated table keep them
+    # as records, which is fine for small deployments.
+    USERS_NAMESPACE = "users"
+
+    def add_users(self, user_ids: list) -> None:
+        for user_id in user_ids:
+            self.put_record(self.USERS_NAMESPACE, str(user_id), {})
+
+    def remove_users(self, user_ids: list) -> None:
+        for user_id in user_ids:
+            self.delete_record(self.USERS_NAMESPACE, str(user_id))
+
+    def count_users(self) -> int:
+        return len(self.load_records(self.USERS_NAMESPACE))
+
+    def user_ids_after(self, cursor: int, limit: int) -> list:
+        """Up to `limit` user ids greater than `cursor`, ascending"""
+        ids = sorted(int(key) for key in self.load_records(self.USERS_NAMESPACE))
+        return ids[bisect.bisect_right(ids, cursor):][:limit]
+
+    def close(self) -> None:
+        pass
+
+
+class JSONVideoStore(VideoStore):
+    """Whole catalog in one JSON file, rewritten atomically on every change."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._videos = {}
+        self._records = {}  # namespace -> {key: value}
+
+    def load_all(self) -> dict:
+        with self._lock:
+            if os.path.exists(self.path):
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._videos = json.load(f)
+            return dict(self._videos)
+
+    @staticmethod
+    def _dump(path: str, data: dict) -> None:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _write(self) -> None:
+        self._dump(self.path, self._videos)
+
+    def _records_path(self, namespace: str) -> str:
+        return f"{os.path.splitext(self.path)[0]}.{namespace}.json"
+
+    def _namespace(self, namespace: str) -> dict:
+        if namespace not in self._records:
+            path = self._records_path(namespace)
+            records = {}
+            if os.path.exists(path):
+                with open(path, "r", encoding="utf-8") as f:
+                    records = json.load(f)
+            self._records[namespace] = records
+        return self._records[namespace]
+
+    def load_records(self, namespace: str) -> dict:
+        with self._lock:
+            return dict(self._namespace(namespace))
+
+    def put_record(self, namespace: str, key: str, value: dict) -> None:
+        with self._lock:
+            records = self._namespace(namespace)
+            records[key] = value
+            self._dump(self._records_path(namespace), records)
+
+    def delete_record(self, namespace: str, key: str) -> None:
+        with self._lock:
+            records = self._namespace(namespace)
+            if records.pop(key, None) is not None:
+                self._dump(self._records_path(namespace), records)
+
+    def upsert_video(self, video_id: str, video: dict) -> None:
+        self.upsert_videos({video_id: video})
+
+    def upsert_videos(self, videos: dict) -> None:
+        with self._lock:
+            self._videos.update(videos)
+            self._write()
+
+    def delete_video(self, video_id: str) -> None:
+        with self._lock:
+            if self._videos.pop(video_id, None) is not None:
+                self._write()
+
+
+class SQLiteVideoStore(VideoStore):
+    """SQLite catalog in WAL mode.
+
+    Each distinct file is one ``media`` row keyed by `file_key`; titles list
+    their files through ``video_files``, so an upload reused across titles is
+    stored once.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS videos (
+            id TEXT PRIMARY KEY,
+            title TEXT NOT NULL,
+            poster TEXT,
+            created_at TEXT,
+            created_by INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS idx_videos_created_at ON videos (created_at);
+        CREATE TABLE IF NOT EXISTS media (
+            unique_id TEXT PRIMARY KEY,
+            type TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            size INTEGER,
+            duration INTEGER,
+            mime_type TEXT,
+            file_name TEXT
+        );
+        CREATE TABLE IF NOT EXISTS video_files (
+            video_id TEXT NOT NULL REFERENCES videos (id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            unique_id TEXT NOT NULL REFERENCES media (unique_id),
+            PRIMARY KEY (video_id, position)
+        );
+        CREATE INDEX IF NOT EXISTS idx_video_files_unique_id ON video_files (unique_id);
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+        CREATE TABLE IF NOT EXISTS records (
+            namespace TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            PRIMARY KEY (namespace, key)
+        );
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            first_seen INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS counts (
+            namespace TEXT NOT NULL,
+            key TEXT NOT NULL,
+            name TEXT NOT NULL,
+            value INTEGER NOT NULL,
+            PRIMARY KEY (namespace, key, name)
+        );
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(self.SCHEMA)
+        self._migrate_files_table()
+        self._seed_users()
+
+    def _migrate_files_table(self) -> None:
+        """Move rows of the old per-title ``files`` table into media/video_files."""
+        legacy = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'files'"
+        ).fetchone()
+        if not legacy:
+            return
+        # Old rows have no file_unique_id, file_key falls back to type and file_id
+        self._conn.executescript(
+            """
+            BEGIN;
+            INSERT OR IGNORE INTO media (unique_id, type, file_id)
+                SELECT type || ':' || file_id, type, file_id FROM files;
+            INSERT OR REPLACE INTO video_files (video_id, position, unique_id)
+                SELECT video_id, position, type || ':' || file_id FROM files;
+            DROP TABLE files;
+            COMMIT;
+            """
+        )
+
+    def _seed_users(self) -> None:
+        """Start the user table from everyone who already received a delivery."""
+        if self._conn.execute("SELECT 1 FROM meta WHERE key = 'users_seeded'").fetchone():
+            return
+        self._conn.executescript(
+            f"""
+            BEGIN;
+            INSERT OR IGNORE INTO users (user_id, first_seen)
+                SELECT CAST(key AS INTEGER), strftime('%s', 'now') FROM records
+                WHERE namespace = '{CatalogCounters.USERS_NAMESPACE}';
+            INSERT OR REPLACE INTO meta (key, value) VALUES ('users_seeded', datetime('now'));
+            COMMIT;
+            """
+        )
+
+    def migrate_from_json(self, json_path: str) -> int:
+        """One-shot import of a legacy videos_data.json, returns the number of videos copied."""
+        with self._lock:
+            done = self._conn.execute(
+                "SELECT value FROM meta WHERE key = 'json_migrated'"
+            ).fetchone()
+        if done or not os.path.exists(json_path):
+            return 0
+
+        with open(json_path, "r", encoding="utf-8") as f:
+            videos = json.load(f)
+        self.upsert_videos(videos)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', ?)",
+                (datetime.datetime.now().isoformat(),),
+            )
+        return len(videos)
+
+    def load_all(self) -> dict:
+        with self._lock:
+            videos = {
+                row[0]: {
+                    "title": row[1],
+                    "poster": row[2],
+                    "files": [],
+                    "created_at": row[3],
+                    "created_by": row[4],
+                }
+                for row in self._conn.execute(
+                    "SELECT id, title, poster, created_at, created_by FROM videos ORDER BY created_at"
+                )
+            }
+            media = {}  # one dict per distinct file, shared by every title using it
+            for row in self._conn.execute(
+                """
+                SELECT vf.video_id, m.unique_id, m.type, m.file_id, m.size, m.duration, m.mime_type, m.file_name
+                FROM video_files vf JOIN media m ON m.unique_id = vf.unique_id
+                ORDER BY vf.video_id, vf.position
+                """
+            ):
+                video_id, unique_id = row[0], row[1]
+                f = media.get(unique_id)
+                if f is None:
+                    f = media[unique_id] = {"type": row[2], "file_id": row[3]}
+                    if ":" not in unique_id:
+                        f["uid"] = unique_id
+                    for field, value in zip(FILE_METADATA, row[4:]):
+                        if value is not None:
+                            f[field] = value
+                if video_id in videos:
+                    videos[video_id]["files"].append(f)
+        return videos
+
+    def _upsert(self, video_id: str, video: dict) -> None:
+        self._conn.execute(
+            """
+            INSERT INTO videos (id, title, poster, created_at, created_by)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET
+                title = excluded.title,
+                poster = excluded.poster,
+                created_at = excluded.created_at,
+                created_by = excluded.created_by
+            """,
+            (
+                video_id,
+                video.get("title") or "",
+                video.get("poster"),
+                video.get("created_at"),
+                video.get("created_by"),
+            ),
+        )
+        files = video.get("files", [])
+        previous = [
+            row[0] for row in self._conn.execute(
+                "SELECT unique_id FROM video_files WHERE video_id = ?", (video_id,)
+            )
+        ]
+        self._conn.executemany(
+            """
+            INSERT INTO media (unique_id, type, file_id, size, duration, mime_type, file_name)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (unique_id) DO UPDATE SET
+                file_id = excluded.file_id,
+                size = COALESCE(excluded.size, media.size),
+                duration = COALESCE(excluded.duration, media.duration),
+                mime_type = COALESCE(excluded.mime_type, media.mime_type),
+                file_name = COALESCE(excluded.file_name, media.file_name)
+            """,
+            [
+                (file_key(f), f["type"], f["file_id"], *(f.get(field) for field in FILE_METADATA))
+                for f in files
+            ],
+        )
+        self._conn.execute("DELETE FROM video_files WHERE video_id = ?", (video_id,))
+        self._conn.executemany(
+            "INSERT INTO video_files (video_id, position, unique_id) VALUES (?, ?, ?)",
+            [(video_id, position, file_key(f)) for position, f in enumerate(files)],
+        )
+        self._prune_media(previous)
+
+    def _prune_media(self, unique_ids: list) -> None:
+        """Drop media rows no title references any more."""
+        self._conn.executemany(
+            """
+            DELETE FROM media WHERE unique_id = ?
+            AND NOT EXISTS (SELECT 1 FROM video_files WHERE video_files.unique_id = media.unique_id)
+            """,
+            [(unique_id,) for unique_id in set(unique_ids)],
+        )
+
+    def upsert_video(self, video_id: str, video: dict) -> None:
+        self.upsert_videos({video_id: video})
+
+    def upsert_videos(self, videos: dict) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for video_id, video in videos.items():
+                    self._upsert(video_id, video)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def delete_video(self, video_id: str) -> None:
+        with self._lock:
+            previous = [
+                row[0] for row in self._conn.execute(
+                    "SELECT unique_id FROM video_files WHERE video_id = ?", (video_id,)
+                )
+            ]
+            self._conn.execute("DELETE FROM videos WHERE id = ?", (video_id,))
+            self._prune_media(previous)
+
+    def load_records(self, namespace: str) -> dict:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, value FROM records WHERE namespace = ?", (namespace,)
+            ).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def put_record(self, namespace: str, key: str, value: dict) -> None:
+        payload = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO records (namespace, key, value) VALUES (?, ?, ?)",
+                (namespace, key, payload),
+            )
+
+    def delete_record(self, namespace: str, key: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM records WHERE namespace = ? AND key = ?", (namespace, key)
+            )
+
+    def add_counts(self, namespace: str, deltas: dict) -> None:
+        rows = [
+            (namespace, key, name, n) for key, counts in deltas.items() for name, n in counts.items()
+        ]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    """
+                    INSERT INTO counts (namespace, key, name, value) VALUES (?, ?, ?, ?)
+                    ON CONFLICT (namespace, key, name) DO UPDATE SET value = value + excluded.value
+                    """,
+                    rows,
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def load_counts(self, namespace: str) -> dict:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, name, value FROM counts WHERE namespace = ?", (namespace,)
+            ).fetchall()
+        counts = {}
+        for key, name, value in rows:
+            counts.setdefault(key, {})[name] = value
+        return counts
+
+    def delete_counts(self, namespace: str, key: str, names: list) -> None:
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM counts WHERE namespace = ? AND key = ? AND name = ?",
+                [(namespace, key, name) for name in names],
+            )
+
+    def add_users(self, user_ids: list) -> None:
+        now = int(time.time())
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO users (user_id, first_seen) VALUES (?, ?)",
+                [(user_id, now) for user_id in user_ids],
+            )
+
+    def remove_users(self, user_ids: list) -> None:
+        with self._lock:
+            self._conn.executemany("DELETE FROM users WHERE user_id = ?", [(user_id,) for user_id in user_ids])
+
+    def count_users(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def user_ids_after(self, cursor: int, limit: int) -> list:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?", (cursor, limit)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class RedisVideoStore(VideoStore):
+    """Catalog and bot state in Redis, shared by every replica.
+
+    Titles live in one hash (a JSON document each) and records in one hash
+    per namespace; users are a sorted set scored by id so broadcasts can page
+    through them. Every catalog write is announced on the "catalog" channel
+    so other replicas refresh their in-memory copy. Any Redis-protocol server
+    works; tests can pass fakeredis clients.
+    """
+
+    shared = True
+    CATALOG_CHANNEL = "catalog"
+
+    def __init__(self, url: str, prefix: str, client=None, async_client=None) -> None:
+        try:
+            import redis
+            import redis.asyncio
+        except ImportError:
+            raise ValueError("STORAGE_BACKEND=redis needs the redis package (pip install redis)")
+        self._redis = redis
+        self.url = url
+        self.prefix = prefix
+        self._client = client or redis.Redis.from_url(url)
+        self._async_client = async_client
+
+    def _key(self, *parts: str) -> str:
+        return self.prefix + ":".join(parts)
+
+    def _announce(self, pipe, video_id: str) -> None:
+        message = json.dumps({"origin": REPLICA_ID, "video_id": video_id})
+        pipe.publish(self._key(self.CATALOG_CHANNEL), message)
+
+    def load_all(self) -> dict:
+        raw = self._client.hgetall(self._key("videos"))
+        return {video_id.decode(): json.loads(video) for video_id, video in raw.items()}
+
+    def get_video(self, video_id: str) -> Optional[dict]:
+        raw = self._client.hget(self._key("videos"), video_id)
+        return json.loads(raw) if raw is not None else None
+
+    def upsert_video(self, video_id: str, video: dict) -> None:
+        self.upsert_videos({video_id: video})
+
+    def upsert_videos(self, videos: dict) -> None:
+        pipe = self._client.pipeline()
+        for video_id, video in videos.items():
+            pipe.hset(self._key("videos"), video_id, json.dumps(video, ensure_ascii=False))
+            self._announce(pipe, video_id)
+        pipe.execute()
+
+    def delete_video(self, video_id: str) -> None:
+        pipe = self._client.pipeline()
+        pipe.hdel(self._key("videos"), video_id)
+        self._announce(pipe, video_id)
+        pipe.execute()
+
+    def load_records(self, namespace: str) -> dict:
+        raw = self._client.hgetall(self._key("records", namespace))
+        return {key.decode(): json.loads(value) for key, value in raw.items()}
+
+    def get_record(self, namespace: str, key: str) -> Optional[dict]:
+        raw = self._client.hget(self._key("records", namespace), key)
+        return json.loads(raw) if raw is not None else None
+
+    def put_record(self, namespace: str, key: str, value: dict) -> None:
+        self._client.hset(self._key("records", namespace), key, json.dumps(value, ensure_ascii=False))
+
+    def delete_record(self, namespace: str, key: str) -> None:
+        self._client.hdel(self._key("records", namespace), key)
+
+    def add_counts(self, namespace: str, deltas: dict) -> None:
+        # One hash per namespace, fields are "<key>:<name>"
+        pipe = self._client.pipeline(transaction=False)
+        for key, counts in deltas.items():
+            for name, n in counts.items():
+                pipe.hincrby(self._key("counts", namespace), f"{key}:{name}", n)
+        pipe.execute()
+
+    def load_counts(self, namespace: str) -> dict:
+        counts = {}
+        for field, value in self._client.hgetall(self._key("counts", namespace)).items():
+            key, _, name = field.decode().rpartition(":")
+            counts.setdefault(key, {})[name] = int(value)
+        return counts
+
+    def delete_counts(self, namespace: str, key: str, names: list) -> None:
+        if names:
+            self._client.hdel(self._key("counts", namespace), *(f"{key}:{name}" for name in names))
+
+    def add_users(self, user_ids: list) -> None:
+        if user_ids:
+            self._client.zadd(self._key("users"), {str(user_id): user_id for user_id in user_ids}, nx=True)
+
+    def remove_users(self, user_ids: list) -> None:
+        if user_ids:
+            self._client.zrem(self._key("users"), *[str(user_id) for user_id in user_ids])
+
+    def count_users(self) -> int:
+        return self._client.zcard(self._key("users"))
+
+    def user_ids_after(self, cursor: int, limit: int) -> list:
+        raw = self._client.zrangebyscore(self._key("users"), f"({cursor}", "+inf", start=0, num=limit)
+        return [int(user_id) for user_id in raw]
+
+    def acquire_lock(self, name: str, owner: str, ttl: float) -> bool:
+        key = self._key("lock", name)
+        ttl_ms = int(ttl * 1000)
+        if self._client.set(key, owner, nx=True, px=ttl_ms):
+            return True
+        # Already held - refresh it if it is ours
+        with self._client.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                if pipe.get(key) != owner.encode():
+                    return False
+                pipe.multi()
+                pipe.pexpire(key, ttl_ms)
+                pipe.execute()
+                return True
+            except self._redis.WatchError:
+                return False
+
+    def release_lock(self, name: str, owner: str) -> None:
+        key = self._key("lock", name)
+        with self._client.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                if pipe.get(key) != owner.encode():
+                    return
+                pipe.multi()
+                pipe.delete(key)
+                pipe.execute()
+            except self._redis.WatchError:
+                pass
+
+    def cache_get_many(self, keys: list) -> list:
+        if not keys:
+            return []
+        raw = self._client.mget([self._key("cache", key) for key in keys])
+        return [json.loads(value) if value is not None else None for value in raw]
+
+    def cache_set(self, key: str, value, ttl: float) -> None:
+        if ttl > 0:
+            self._client.set(self._key("cache", key), json.dumps(value), px=int(ttl * 1000))
+
+    def cache_delete(self, key: str) -> None:
+        self._client.delete(self._key("cache", key))
+
+    async def listen(self, channel: str, callback) -> None:
+        """Runs until cancelled, reconnecting if the connection drops.
+
+        Events published while disconnected are lost, so every reconnect is
+        followed by a ``{"resync": True}`` event.
+        """
+        reconnecting = False
+        while True:
+            client = self._async_client or self._redis.asyncio.Redis.from_url(self.url)
+            pubsub = client.pubsub()
+            try:
+                await pubsub.subscribe(self._key(channel))
+                if reconnecting:
+                    await callback({"resync": True})
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    event = json.loads(message["data"])
+                    if event.get("origin") != REPLICA_ID:
+                        await callback(event)
+            except self._redis.ConnectionError as e:
+                logger.error(f"Lost Redis subscription to {channel}, reconnecting: {e}")
+                reconnecting = True
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+                if client is not self._async_client:
+                    await client.aclose()
+
+    def close(self) -> None:
+        self._client.close()
+
+
+def open_store() -> VideoStore:
+    if STORAGE_BACKEND == "json":
+        return JSONVideoStore(DATA_FILE)
+    if STORAGE_BACKEND == "redis":
+        return RedisVideoStore(REDIS_URL, REDIS_PREFIX)
+    if STORAGE_BACKEND == "sqlite":
+        store = SQLiteVideoStore(DB_PATH)
+        migrated = store.migrate_from_json(DATA_FILE)
+        if migrated:
+            logger.info(f"Migrated {migrated} videos from {DATA_FILE} to {DB_PATH}")
+        return store
+    raise ValueError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
+
+
+# ================== DELIVERY QUEUE ==================
+def is_transient_error(e: Exception) -> bool:
+    """Errors worth retrying - BadRequest is a NetworkError subclass but never transient."""
+    if isinstance(e, (RetryAfter, TimedOut)):
+        return True
+    return isinstance(e, NetworkError) and not isinstance(e, BadRequest)
+
+
+class DeliveryQueue:
+    """Persistent queue of delivery jobs drained by a pool of worker tasks.
+
+    Jobs are plain dicts stored in the "deliveries" namespace of the store.
+    The handler checkpoints a job as it progresses and returns True once the
+    job is finished (it is then removed) or False if it stopped early because
+    the queue is shutting down. Unfinished jobs are picked up again on start.
+    Queued and running jobs are indexed by (user_id, video_id) so a repeated
+    request can find the delivery already under way.
+
+    Each job also holds the store lock "delivery:<user_id>:<video_id>" for
+    `owner`. On a shared store this keeps a second replica from taking the
+    same request, and `refresh` renews the locks and adopts stored jobs whose
+    replica went away. Local stores grant every lock.
+    """
+
+    NAMESPACE = "deliveries"
+
+    def __init__(self, store: VideoStore, handler, workers: int, owner: str, lock_ttl: float) -> None:
+        self.store = store
+        self._handler = handler
+        self._workers = workers
+        self.owner = owner
+        self.lock_ttl = lock_ttl
+        self._queue = asyncio.Queue()
+        self._tasks = []
+        self.by_key = {}  # (user_id, video_id) -> job
+        self.stopping = False
+        self.active = 0
+
+    @staticmethod
+    def key(job: dict) -> tuple:
+        return job["user_id"], job["video_id"]
+
+    def find(self, user_id: int, video_id: str) -> Optional[dict]:
+        return self.by_key.get((user_id, video_id))
+
+    @staticmethod
+    def lock_name(job: dict) -> str:
+        return f"delivery:{job['user_id']}:{job['video_id']}"
+
+    async def _lock(self, job: dict) -> bool:
+        return await asyncio.to_thread(self.store.acquire_lock, self.lock_name(job), self.owner, self.lock_ttl)
+
+    async def _unlock(self, job: dict) -> None:
+        await asyncio.to_thread(self.store.release_lock, self.lock_name(job), self.owner)
+
+    async def start(self) -> None:
+        adopted = await self.refresh()
+        if adopted:
+            logger.info(f"Resuming {adopted} unfinished deliveries")
+
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self._workers)]
+
+    async def refresh(self) -> int:
+        """Renew the locks of our jobs and adopt stored jobs nobody holds, returns the number adopted"""
+        pending = await asyncio.to_thread(self.store.load_records, self.NAMESPACE)
+        adopted = 0
+        for job in sorted(pending.values(), key=lambda j: j["created_at"]):
+            ours = self.by_key.get(self.key(job))
+            if ours is not None:
+                await self._lock(ours)
+                continue
+            if not await self._lock(job):
+                continue
+            # The job may have finished while we were looking at it
+            if await asyncio.to_thread(self.store.get_record, self.NAMESPACE, job["id"]) is None:
+                await self._unlock(job)
+                continue
+            job["resumed"] = True
+            self.by_key[self.key(job)] = job
+            self._queue.put_nowait(job)
+            adopted += 1
+        return adopted
+
+    async def stop(self, timeout: float) -> None:
+        """Let busy workers reach their next checkpoint, then stop them."""
+        self.stopping = True
+        for _ in self._tasks:
+            self._queue.put_nowait(None)
+        if self._tasks:
+            _, pending = await asyncio.wait(self._tasks, timeout=timeout)
+            for task in pending:
+                task.cancel()
+        self._tasks = []
+        # Unfinished jobs stay stored, let another replica pick them up right away
+        for job in list(self.by_key.values()):
+            try:
+                await self._unlock(job)
+            except Exception as e:
+                logger.error(f"Error releasing delivery job {job['id']}: {e}")
+
+    async def submit(self, job: dict) -> bool:
+        """Queue `job`, returns False if another replica is already delivering it"""
+        # Registered before the first await so a concurrent duplicate sees it
+        self.by_key[self.key(job)] = job
+        try:
+            locked = await self._lock(job)
+        except Exception:
+            del self.by_key[self.key(job)]
+            raise
+        if not locked:
+            del self.by_key[self.key(job)]
+            return False
+        await self.save(job)
+        self._queue.put_nowait(job)
+        return True
+
+    async def save(self, job: dict) -> None:
+        await asyncio.to_thread(self.store.put_record, self.NAMESPACE, job["id"], job)
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            if job is None or self.stopping:
+                return
+
+            self.active += 1
+            try:
+                finished = await self._handler(job)
+            except Exception as e:
+                logger.error(f"Delivery job {job['id']} crashed: {e}")
+                finished = True
+            finally:
+                self.active -= 1
+
+            if finished:
+                try:
+                    # Record first, so `refresh` never sees a stored job that has no owner
+                    await asyncio.to_thread(self.store.delete_record, self.NAMESPACE, job["id"])
+                    if self.by_key.get(self.key(job)) is job:
+                        del self.by_key[self.key(job)]
+                    await self._unlock(job)
+                except Exception as e:
+                    logger.error(f"Error removing delivery job {job['id']}: {e}")
+
+    def stats(self) -> dict:
+        return {"queued": self._queue.qsize(), "active": self.active}
+
+
+# ================== BROADCAST ==================
+class BroadcastRunner:
+    """Sends one broadcast to every stored user and survives restarts.
+
+    Users are read in user_id order one page at a time and fanned out to
+    `workers` concurrent sends; the SendScheduler paces them at the global
+    rate limit with bulk priority, so interactive traffic still goes first.
+    The job (cursor = last user id of a finished page, plus counts) is
+    checkpointed in the "broadcasts" namespace after each page, so at most
+    one page is repeated after a crash. Users who blocked the bot are removed
+    from the user table. Only the holder of the "broadcast" store lock runs
+    it, and on a shared store a run stops once another replica cancelled it.
+    """
 
-# ================== BOT CONFIGURATION ==================
-BOT_TOKEN = os.environ.get("BOT_TOKEN", "8327527686:AAFgeRamSxQudV0IKOSh9xUlJs3IsGbL3Xs")
-ADMIN_IDS = [int(x) for x in os.environ.get("ADMIN_IDS", "6532419818").split(",")]
-FORCE_SUB_CHANNEL = os.environ.get("FORCE_SUB_CHANNEL", "@gullymovies")
+    NAMESPACE = "broadcasts"
+    KEY = "current"
+    LOCK = "broadcast"
 
-videos_data = {}
-user_sessions = {}
+    def __init__(self, store: VideoStore, send, workers: int, page_size: int, owner: str, lock_ttl: float) -> None:
+        self.store = store
+        self._send = send  # async send(user_id, job)
+        self.workers = workers
+        self.page_size = page_size
+        self.owner = owner
+        self.lock_ttl = lock_ttl
+        self.job = None
+        self.task = None
+        self.rate = 0.0  # users per second in the current run
+
+    async def load(self) -> Optional[dict]:
+        return (await asyncio.to_thread(self.store.load_records, self.NAMESPACE)).get(self.KEY)
+
+    async def save(self, job: dict) -> None:
+        await asyncio.to_thread(self.store.put_record, self.NAMESPACE, self.KEY, job)
+
+    async def discard(self) -> None:
+        self.job = None
+        await asyncio.to_thread(self.store.delete_record, self.NAMESPACE, self.KEY)
+        await self.release()
+
+    async def claim(self) -> bool:
+        """Take (or keep) the right to run the broadcast"""
+        return await asyncio.to_thread(self.store.acquire_lock, self.LOCK, self.owner, self.lock_ttl)
+
+    async def release(self) -> None:
+        await asyncio.to_thread(self.store.release_lock, self.LOCK, self.owner)
+
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def eta(self, job: dict) -> Optional[float]:
+        remaining = job["total"] - self.processed(job)
+        return remaining / self.rate if self.rate else None
+
+    @staticmethod
+    def processed(job: dict) -> int:
+        return job["sent"] + job["failed"] + job["pruned"]
+
+    async def run(self, job: dict, on_progress) -> bool:
+        """Send `job` from its cursor to the end, calling `on_progress(job)` after each page.
+
+        Returns False if the broadcast was cancelled or taken over elsewhere.
+        """
+        self.job = job
+        self.rate = 0.0
+        semaphore = asyncio.Semaphore(self.workers)
+        started = time.monotonic()
+        done_this_run = 0
+
+        async def deliver(user_id: int) -> str:
+            async with semaphore:
+                try:
+                    await self._send(user_id, job)
+                    return "sent"
+                except Forbidden:
+                    return "blocked"
+                except TelegramError as e:
+                    logger.debug(f"Broadcast to {user_id} failed: {e}")
+                    return "failed"
+
+        while True:
+            if self.store.shared:
+                saved = await asyncio.to_thread(self.store.get_record, self.NAMESPACE, self.KEY)
+                if saved is None or saved["id"] != job["id"] or not await self.claim():
+                    self.job = None
+                    return False
+            user_ids = await asyncio.to_thread(self.store.user_ids_after, job["cursor"], self.page_size)
+            if not user_ids:
+                return True
+            results = await asyncio.gather(*(deliver(user_id) for user_id in user_ids))
+            blocked = [user_id for user_id, result in zip(user_ids, results) if result == "blocked"]
+            if blocked:
+                await asyncio.to_thread(self.store.remove_users, blocked)
+
+            job["sent"] += results.count("sent")
+            job["failed"] += results.count("failed")
+            job["pruned"] += len(blocked)
+            job["cursor"] = user_ids[-1]
+            await self.save(job)
+
+            done_this_run += len(user_ids)
+            self.rate = done_this_run / max(time.monotonic() - started, 1e-6)
+            await on_progress(job)
+
+
+# ================== ADMIN SESSIONS ==================
+class SessionStore:
+    """In-progress /addvideo drafts keyed by admin user id.
+
+    Drafts idle for longer than `ttl` are removed by `sweep`, and starting a
+    new one beyond `max_size` evicts the least recently touched. Every change
+    is written through to the "sessions" namespace of the store so a wizard
+    survives a restart.
+    """
+
+    NAMESPACE = "sessions"
+
+    def __init__(self, store: VideoStore, ttl: int, max_size: int) -> None:
+        self.store = store
+        self.ttl = ttl
+        self.max_size = max_size
+        self._sessions = OrderedDict()  # least recently touched first
+        self.expired = 0
+        self.evicted = 0
+
+    def load(self) -> None:
+        records = self.store.load_records(self.NAMESPACE)
+        for key, session in sorted(records.items(), key=lambda item: item[1].get("updated_at", 0)):
+            self._sessions[int(key)] = session
+
+    def get(self, user_id: int) -> Optional[dict]:
+        return self._sessions.get(user_id)
+
+    async def fetch(self, user_id: int) -> Optional[dict]:
+        """`get`, but on a shared store the stored draft wins over a stale local copy.
+
+        An admin's messages may reach any replica, so the draft another
+        replica just advanced has to be read back before acting on it.
+        """
+        session = self._sessions.get(user_id)
+        if not self.store.shared:
+            return session
+        stored = await asyncio.to_thread(self.store.get_record, self.NAMESPACE, str(user_id))
+        if stored is None:
+            self._sessions.pop(user_id, None)
+            return None
+        if session is None or stored.get("updated_at", 0) > session.get("updated_at", 0):
+            self._sessions[user_id] = session = stored
+            self._sessions.move_to_end(user_id)
+        return session
+
+    async def reload(self) -> None:
+        """Replace the local drafts with the stored ones"""
+        self._sessions.clear()
+        await asyncio.to_thread(self.load)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    async def start(self, user_id: int, session: dict) -> list:
+        """Open a draft, returning the ``(user_id, session)`` pairs evicted to make room."""
+        self._sessions.pop(user_id, None)
+        evicted = []
+        while len(self._sessions) >= self.max_size:
+            evicted.append(self._sessions.popitem(last=False))
+        for old_user_id, _ in evicted:
+            await asyncio.to_thread(self.store.delete_record, self.NAMESPACE, str(old_user_id))
+        self.evicted += len(evicted)
+
+        self._sessions[user_id] = session
+        await self.save(user_id)
+        return evicted
+
+    async def save(self, user_id: int) -> None:
+        session = self._sessions.get(user_id)
+        if session is None:
+            return
+        session["updated_at"] = time.time()
+        self._sessions.move_to_end(user_id)
+        # Snapshot, the handler may keep appending files while the write runs
+        snapshot = dict(session, files=list(session["files"]))
+        await asyncio.to_thread(self.store.put_record, self.NAMESPACE, str(user_id), snapshot)
+
+    async def discard(self, user_id: int) -> None:
+        # A shared store may hold a draft this replica never loaded
+        if self._sessions.pop(user_id, None) is not None or self.store.shared:
+            await asyncio.to_thread(self.store.delete_record, self.NAMESPACE, str(user_id))
+
+    async def sweep(self) -> list:
+        """Drop drafts idle for longer than the TTL and return them."""
+        cutoff = time.time() - self.ttl
+        expired = []
+        while self._sessions:
+            user_id, session = next(iter(self._sessions.items()))
+            if session.get("updated_at", 0) > cutoff:
+                break
+            del self._sessions[user_id]
+            expired.append((user_id, session))
+        for user_id, _ in expired:
+            await asyncio.to_thread(self.store.delete_record, self.NAMESPACE, str(user_id))
+        self.expired += len(expired)
+        return expired
+
+
+# ================== COUNTERS ==================
+class RollingWindow:
+    """Event count over the last `seconds`, kept as per-minute buckets."""
+
+    def __init__(self, seconds: int) -> None:
+        self.seconds = seconds
+        self.buckets = deque()  # [minute, count]
+        self.total = 0
+
+    def _expire(self, now: float) -> None:
+        oldest = int(now // 60) - self.seconds // 60
+        while self.buckets and self.buckets[0][0] <= oldest:
+            self.total -= self.buckets.popleft()[1]
+
+    def add(self, now: float, count: int = 1) -> None:
+        minute = int(now // 60)
+        if self.buckets and self.buckets[-1][0] == minute:
+            self.buckets[-1][1] += count
+        else:
+            self.buckets.append([minute, count])
+        self.total += count
+        self._expire(now)
+
+    def count(self, now: float) -> int:
+        self._expire(now)
+        return self.total
+
+
+class CatalogCounters:
+    """/stats numbers maintained as catalog writes and deliveries happen.
+
+    Everything /stats shows is read in O(1): totals are running sums, the
+    top titles are kept sorted on every delivery, and 1h/24h rates come from
+    per-minute buckets. Served user ids live in their own store namespace so
+    a new user costs one small write instead of rewriting the whole set.
+
+    With `shared` set (replicas on one store) catalog totals are derived from
+    the shared catalog, and delivery numbers are kept as increments in the
+    SHARED_NAMESPACE counts instead of one record: `pending` collects them
+    between flushes and `apply_counts` loads what all replicas wrote.
+    """
+
+    NAMESPACE = "counters"
+    KEY = "stats"
+    USERS_NAMESPACE = "served_users"
+    SHARED_NAMESPACE = "delivery_counts"
+
+    def __init__(self, top_n: int = STATS_TOP_N, shared: bool = False) -> None:
+        self.top_n = top_n
+        self.shared = shared
+        self.pending = {}  # counts key -> {name: increment}, shared mode only
+        self.videos = 0
+        self.files_by_type = {}
+        self.deliveries_completed = 0
+        self.deliveries_failed = 0
+        self.per_video = {}
+        self.top = []  # video ids ordered by per_video count, at most top_n
+        self.served_users = set()
+        self.last_hour = RollingWindow(3600)
+        self.last_day = RollingWindow(86400)
+        self.dirty = False
+
+    def load(self, store: VideoStore, catalog: dict) -> None:
+        self.served_users = {int(user_id) for user_id in store.load_records(self.USERS_NAMESPACE)}
+        if self.shared:
+            for video in catalog.values():
+                self.record_video(video)
+            self.apply_counts(store.load_counts(self.SHARED_NAMESPACE))
+            self.dirty = False
+            return
+
+        saved = store.get_record(self.NAMESPACE, self.KEY)
+        if saved is None:
+            # First start with counters - derive catalog totals once
+            for video in catalog.values():
+                self.record_video(video)
+            return
+
+        self.videos = saved["videos"]
+        self.files_by_type = saved["files_by_type"]
+        self.deliveries_completed = saved["deliveries_completed"]
+        self.deliveries_failed = saved["deliveries_failed"]
+        self.per_video = saved["per_video"]
+        for minute, count in saved["minutes"]:
+            self.last_hour.add(minute * 60, count)
+            self.last_day.add(minute * 60, count)
+        self._rebuild_top()
+
+    def to_dict(self) -> dict:
+        return {
+            "videos": self.videos,
+            "files_by_type": self.files_by_type,
+            "deliveries_completed": self.deliveries_completed,
+            "deliveries_failed": self.deliveries_failed,
+            "per_video": self.per_video,
+            "minutes": list(self.last_day.buckets),
+        }
+
+    def apply_counts(self, counts: dict) -> list:
+        """Take delivery numbers from SHARED_NAMESPACE counts, returns minutes older than a day"""
+        # Increments not flushed yet aren't in `counts`, add them back
+        totals, pending = counts.get("deliveries", {}), self.pending.get("deliveries", {})
+        self.deliveries_completed = totals.get("completed", 0) + pending.get("completed", 0)
+        self.deliveries_failed = totals.get("failed", 0) + pending.get("failed", 0)
+        self.per_video = dict(counts.get("per_video", {}))
+        for video_id, n in self.pending.get("per_video", {}).items():
+            self.per_video[video_id] = self.per_video.get(video_id, 0) + n
+
+        minutes = dict(counts.get("minutes", {}))
+        for minute, n in self.pending.get("minutes", {}).items():
+            minutes[minute] = minutes.get(minute, 0) + n
+        now = time.time()
+        self.last_hour = RollingWindow(3600)
+        self.last_day = RollingWindow(86400)
+        stale = []
+        for minute in sorted(minutes, key=int):
+            if int(minute) <= int(now // 60) - 1440:
+                stale.append(minute)
+                continue
+            self.last_hour.add(int(minute) * 60, minutes[minute])
+            self.last_day.add(int(minute) * 60, minutes[minute])
+        self._rebuild_top()
+        return stale
+
+    def _count(self, key: str, name: str) -> None:
+        counts = self.pending.setdefault(key, {})
+        counts[name] = counts.get(name, 0) + 1
+
+    def _rebuild_top(self) -> None:
+        self.top = heapq.nlargest(self.top_n, self.per_video, key=self.per_video.get)
+
+    def record_video(self, video: dict) -> None:
+        self.videos += 1
+        for f in video.get("files", []):
+            ftype = f.get("type", "other")
+            self.files_by_type[ftype] = self.files_by_type.get(ftype, 0) + 1
+        self.dirty = True
+
+    def forget_video(self, video: dict) -> None:
+        """Undo `record_video`, used when a title is replaced"""
+        self.videos -= 1
+        for f in video.get("files", []):
+            ftype = f.get("type", "other")
+            self.files_by_type[ftype] = self.files_by_type.get(ftype, 0) - 1
+        self.dirty = True
+
+    def record_delivery(self, video_id: str, user_id: int, ok: bool) -> bool:
+        """Count a finished delivery, returns True if `user_id` was served for the first time"""
+        self.dirty = True
+        if not ok:
+            self.deliveries_failed += 1
+            if self.shared:
+                self._count("deliveries", "failed")
+            return False
+
+        self.deliveries_completed += 1
+        now = time.time()
+        self.last_hour.add(now)
+        self.last_day.add(now)
+        if self.shared:
+            self._count("deliveries", "completed")
+            self._count("per_video", video_id)
+            self._count("minutes", str(int(now // 60)))
+
+        count = self.per_video[video_id] = self.per_video.get(video_id, 0) + 1
+        if video_id in self.top:
+            self.top.sort(key=self.per_video.get, reverse=True)
+        elif len(self.top) < self.top_n or count > self.per_video[self.top[-1]]:
+            self.top.append(video_id)
+            self.top.sort(key=self.per_video.get, reverse=True)
+            del self.top[self.top_n:]
+
+        if user_id in self.served_users:
+            return False
+        self.served_users.add(user_id)
+        return True
+
+    def total_files(self) -> int:
+        return sum(self.files_by_type.values())
+
+    def rates(self) -> tuple:
+        now = time.time()
+        return self.last_hour.count(now), self.last_day.count(now)
+
+    def top_videos(self) -> list:
+        return [(video_id, self.per_video[video_id]) for video_id in self.top]
+
+
+class FeedbackTally:
+    """Feedback button taps per title, counted in memory and written in batches.
+
+    A tap only bumps a dict entry; `flush` hands everything pending since the
+    last flush to the store as one `add_counts` call. `totals` (per kind,
+    across titles) backs /stats.
+    """
+
+    NAMESPACE = "feedback"
+
+    def __init__(self, store: VideoStore) -> None:
+        self.store = store
+        self.pending = {}  # video_id -> {kind: taps}
+        self.totals = {}
+
+    def load(self) -> None:
+        totals = {}
+        for counts in [*self.store.load_counts(self.NAMESPACE).values(), *self.pending.values()]:
+            for kind, n in counts.items():
+                totals[kind] = totals.get(kind, 0) + n
+        self.totals = totals
+
+    def record(self, video_id: str, kind: str) -> None:
+        counts = self.pending.setdefault(video_id, {})
+        counts[kind] = counts.get(kind, 0) + 1
+        self.totals[kind] = self.totals.get(kind, 0) + 1
+
+    async def flush(self) -> None:
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, {}
+        try:
+            await asyncio.to_thread(self.store.add_counts, self.NAMESPACE, batch)
+        except Exception as e:
+            # Keep the taps for the next flush
+            for video_id, counts in batch.items():
+                pending = self.pending.setdefault(video_id, {})
+                for kind, n in counts.items():
+                    pending[kind] = pending.get(kind, 0) + n
+            logger.error(f"Error saving feedback: {e}")
+
+
+# ================== CATALOG INDEX ==================
+# Split on whitespace and punctuation only - \w would break Indic titles apart at vowel signs
+TOKEN_SPLIT = re.compile(r"[\s\-_.,:;!?()\[\]{}|/\\+'\"&@#*~`]+")
+
+
+def tokenize(text: str) -> list:
+    return [token for token in TOKEN_SPLIT.split(text.lower()) if token]
+
+
+class CatalogIndex:
+    """In-memory indexes over the catalog, updated as titles are added.
+
+    ``order`` keeps ``(created_at, video_id)`` sorted for cursor pagination,
+    ``tokens`` maps each title token to the ids containing it and
+    ``sorted_tokens`` turns a prefix into a contiguous slice of tokens.
+    """
+
+    def __init__(self) -> None:
+        self.order = []
+        self.tokens = {}
+        self.sorted_tokens = []  # distinct tokens, sorted for prefix lookups
+        self.created = {}  # video_id -> sort key
+
+    def build(self, catalog: dict) -> None:
+        self.order = sorted((video.get("created_at") or "", video_id) for video_id, video in catalog.items())
+        self.created = {video_id: key for key, video_id in self.order}
+        self.tokens = {}
+        for video_id, video in catalog.items():
+            for token in set(tokenize(video.get("title", ""))):
+                self.tokens.setdefault(token, set()).add(video_id)
+        self.sorted_tokens = sorted(self.tokens)
+
+    def add(self, video_id: str, video: dict, previous: Optional[dict] = None) -> None:
+        """Index `video`; `previous` is the entry it replaces, if the id is indexed already"""
+        if previous is not None:
+            self.remove(video_id, previous)
+        key = video.get("created_at") or ""
+        bisect.insort(self.order, (key, video_id))
+        self.created[video_id] = key
+        for token in set(tokenize(video.get("title", ""))):
+            if token not in self.tokens:
+                bisect.insort(self.sorted_tokens, token)
+            self.tokens.setdefault(token, set()).add(video_id)
+
+    def remove(self, video_id: str, video: dict) -> None:
+        """Unindex `video_id`; `video` must be the entry it was indexed with"""
+        key = self.created.pop(video_id, None)
+        if key is None:
+            return
+        position = bisect.bisect_left(self.order, (key, video_id))
+        if position < len(self.order) and self.order[position] == (key, video_id):
+            del self.order[position]
+        for token in set(tokenize(video.get("title", ""))):
+            ids = self.tokens.get(token)
+            if ids is None:
+                continue
+            ids.discard(video_id)
+            if not ids:
+                del self.tokens[token]
+                del self.sorted_tokens[bisect.bisect_left(self.sorted_tokens, token)]
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def page(self, cursor: Optional[str] = None, newer: bool = False, size: int = LIST_PAGE_SIZE):
+        """Newest-first page next to `cursor` (a video id).
+
+        Returns ``(video_ids, start_rank)`` where ``start_rank`` is the
+        0-based newest-first position of the first id on the page.
+        """
+        total = len(self.order)
+        if cursor in self.created:
+            position = bisect.bisect_left(self.order, (self.created[cursor], cursor))
+            # `order` is oldest-first; a newest-first page ends just before `position`
+            end = min(total, position + 1 + size) if newer else position
+        else:
+            end = total
+        start = max(0, end - size)
+        ids = [video_id for _, video_id in reversed(self.order[start:end])]
+        return ids, total - end
+
+    def search(self, query: str, limit: int = FIND_MAX_RESULTS) -> list:
+        """Ids whose titles contain every word of `query`, newest first."""
+        words = tokenize(query)
+        if not words:
+            return []
+        postings = sorted((self.tokens.get(word, set()) for word in words), key=len)
+        matches = set(postings[0]).intersection(*postings[1:])
+        return heapq.nlargest(limit, matches, key=lambda video_id: (self.created[video_id], video_id))
+
+    def prefix_search(self, query: str, limit: int) -> list:
+        """Like `search`, but every query word matches title tokens starting with it.
+
+        An empty query returns the newest titles.
+        """
+        words = tokenize(query)
+        if not words:
+            return [video_id for _, video_id in reversed(self.order[-limit:])]
+
+        matches = None
+        for word in sorted(set(words), key=len, reverse=True):
+            start = bisect.bisect_left(self.sorted_tokens, word)
+            end = bisect.bisect_left(self.sorted_tokens, word + "\U0010ffff", start)
+            ids = set()
+            for token in self.sorted_tokens[start:end]:
+                ids.update(self.tokens[token])
+            matches = ids if matches is None else matches & ids
+            if not matches:
+                return []
+        return heapq.nlargest(limit, matches, key=lambda video_id: (self.created[video_id], video_id))
+
+
+# ================== FILE REGISTRY ==================
+class FileRegistry:
+    """Every distinct catalog file, held once and shared by the titles using it.
+
+    Files are keyed by `file_key`. Titles that contain the same upload point
+    at one dict, and ``refs`` tracks which titles use each file for duplicate
+    warnings and reuse stats.
+    """
+
+    def __init__(self) -> None:
+        self.files = {}  # file_key -> file dict
+        self.refs = {}   # file_key -> set of video ids
+
+    def build(self, catalog: dict) -> None:
+        self.files = {}
+        self.refs = {}
+        for video_id, video in catalog.items():
+            self.add(video_id, video)
+
+    def intern(self, f: dict) -> dict:
+        key = file_key(f)
+        known = self.files.get(key)
+        if known is None:
+            self.files[key] = f
+            return f
+        for field, value in f.items():
+            known.setdefault(field, value)
+        return known
+
+    def add(self, video_id: str, video: dict) -> None:
+        video["files"] = [self.intern(f) for f in video.get("files", [])]
+        for f in video["files"]:
+            self.refs.setdefault(file_key(f), set()).add(video_id)
+
+    def remove(self, video_id: str, video: dict) -> None:
+        for f in video.get("files", []):
+            key = file_key(f)
+            users = self.refs.get(key)
+            if users is None:
+                continue
+            users.discard(video_id)
+            if not users:
+                del self.refs[key]
+                self.files.pop(key, None)
+
+    def titles_using(self, f: dict) -> set:
+        return self.refs.get(file_key(f), set())
+
+    def stats(self) -> dict:
+        references = sum(len(users) for users in self.refs.values())
+        return {
+            "files": len(self.files),
+            "references": references,
+            "shared": sum(1 for users in self.refs.values() if len(users) > 1),
+        }
+
+
+# ================== ALBUM BATCHING ==================
+MEDIA_GROUP_LIMIT = 10
+
+# Telegram only lets photos and videos share an album; documents and audio
+# must each be grouped with their own kind.
+ALBUM_KIND = {"photo": "visual", "video": "visual", "document": "document", "audio": "audio"}
+
+# Imported posts have no file_id, they are re-sent with copyMessage from the
+# source channel. Their file_id is "<from_chat_id>/<message_id>".
+COPY_TYPE = "copy"
+
+INPUT_MEDIA = {
+    "photo": InputMediaPhoto,
+    "video": InputMediaVideo,
+    "document": InputMediaDocument,
+    "audio": InputMediaAudio,
+}
+
+
+def build_media_batches(files: list, poster: Optional[str] = None) -> list:
+    """Split a title into ordered send_media_group batches.
+
+    Consecutive files of a compatible kind share a batch of at most
+    MEDIA_GROUP_LIMIT items. The poster leads the first batch when that batch
+    is a photo/video album, otherwise it is sent on its own. Each item is the
+    stored file dict; the poster is marked with ``"poster": True``. Copied
+    posts can't be grouped and always form a batch of their own.
+    """
+    items = [f for f in files if f.get("type") in ALBUM_KIND or f.get("type") == COPY_TYPE]
+    if poster:
+        items.insert(0, {"type": "photo", "file_id": poster, "poster": True})
+
+    batches = []
+    current, current_kind = [], None
+    for item in items:
+        kind = ALBUM_KIND.get(item["type"])
+        if current and (kind is None or kind != current_kind or len(current) >= MEDIA_GROUP_LIMIT):
+            batches.append(current)
+            current = []
+        current.append(item)
+        current_kind = kind
+    if current:
+        batches.append(current)
+    return batches
+
+
+# ================== CALLBACK DATA ==================
+# Buttons carry "<version><route>[:<arg>...]", e.g. "1v:<video_id>". It is short,
+# leaving room for ids in Telegram's 64-byte limit, and versioned so the format can
+# change without breaking buttons already sitting in chats. Every route's pattern
+# also accepts the unversioned data that older buttons still send.
+CALLBACK_VERSION = "1"
+
+
+def callback_data(route: str, *args) -> str:
+    return ":".join((CALLBACK_VERSION + route, *map(str, args)))
+
+
+_V = re.escape(CALLBACK_VERSION)
+CALLBACK_PATTERNS = {
+    # Verify Now, optionally for a video: 1v[:<video_id>] / check_sub[_<video_id>]
+    "verify": re.compile(rf"^(?:{_V}v|check_sub)(?:[:_](.+))?$"),
+    # Copy link: 1c:<video_id> / copy_<video_id>
+    "copy": re.compile(rf"^(?:{_V}c:|copy_)(.+)$"),
+    # Feedback: 1f:<kind code>:<video_id> / feedback_<kind>
+    "feedback": re.compile(rf"^(?:{_V}f:|feedback_)([a-z]+)(?::(.+))?$"),
+    # /listvideos paging: 1p:<n|o>:<video_id> / lv_<newer|older>_<video_id>
+    "page": re.compile(rf"^(?:{_V}p:|lv_)(n|o|newer|older)[:_](.+)$"),
+    # /addvideo draft actions
+    "finish": re.compile(rf"^(?:{_V}d:f|finish_video)$"),
+    "continue": re.compile(rf"^(?:{_V}d:m|continue_files)$"),
+    "cancel": re.compile(rf"^(?:{_V}d:x|cancel_video)$"),
+}
+
+# Feedback code -> (kind, emoji); old buttons send the kind itself
+FEEDBACK_KINDS = {"l": ("love", "❤️"), "s": ("super", "🔥"), "a": ("amazing", "💫"), "g": ("good", "👍")}
+FEEDBACK_KINDS.update({kind: (kind, emoji) for kind, emoji in list(FEEDBACK_KINDS.values())})
+
+
+# ================== DELIVERY PLANS ==================
+class PlanStep:
+    """One send call of a plan: an album, or a single file / the poster.
+
+    `media` holds the prebuilt InputMedia list for albums (None otherwise),
+    `batch` the file dicts behind it for the one-by-one fallback.
+    """
+
+    def __init__(self, batch: list, poster_caption: str) -> None:
+        self.batch = tuple(batch)
+        self.files = sum(1 for f in batch if not f.get("poster"))
+        self.poster = any(f.get("poster") for f in batch)
+        self.media = None
+        if len(batch) > 1:
+            self.media = tuple(
+                INPUT_MEDIA[f["type"]](
+                    f["file_id"],
+                    caption=poster_caption if f.get("poster") else None,
+                    parse_mode="Markdown" if f.get("poster") else None,
+                )
+                for f in batch
+            )
+
+
+class DeliveryPlan:
+    """A title compiled into the send calls that deliver it.
+
+    Plans are built once and shared by every delivery of the title, so they
+    are never modified; a catalog change replaces them. `first_file` is the
+    file index the plan starts at - 0 for cached plans, later for a resumed
+    job whose checkpoint no longer falls between two steps.
+    """
+
+    def __init__(self, video_id: str, video: dict, with_poster: bool, first_file: int = 0) -> None:
+        self.title = video["title"]
+        self.total = len(video.get("files", []))
+        self.first_file = first_file
+        self.poster_caption = f"🎬 *{self.title}*\n\nPreparing {self.total} files..."
+
+        files = video.get("files", [])[first_file:]
+        poster = video.get("poster") if with_poster else None
+        if DELIVERY_MODE == "single":
+            batches = [[f] for f in files if f.get("type") in ALBUM_KIND or f.get("type") == COPY_TYPE]
+            if poster:
+                batches.insert(0, [{"type": "photo", "file_id": poster, "poster": True}])
+        else:
+            batches = build_media_batches(files, poster)
+        self.steps = tuple(PlanStep(batch, self.poster_caption) for batch in batches)
+        self.feedback_markup = InlineKeyboardMarkup([
+            [InlineKeyboardButton("❤️ Loved It!", callback_data=callback_data("f", "l", video_id)),
+             InlineKeyboardButton("🔥 Super", callback_data=callback_data("f", "s", video_id))],
+        ])
+
+        # offsets[i] = files sent before step i, so a checkpoint maps to a step
+        self.offsets = []
+        sent = first_file
+        for step in self.steps:
+            self.offsets.append(sent)
+            sent += step.files
+        self.end = sent
+
+    def steps_from(self, next_file: int) -> Optional[tuple]:
+        """Steps left after `next_file` files were sent, None if that isn't a step boundary"""
+        i = bisect.bisect_left(self.offsets, next_file)
+        if i < len(self.offsets) and self.offsets[i] == next_file:
+            return self.steps[i:]
+        if next_file >= self.end:
+            return ()
+        return None
+
+
+# ================== CHANNEL IMPORT ==================
+EXPORT_MESSAGES_KEY = re.compile(r'(?<!\\)"messages"\s*:\s*\[')
+EXPORT_HEADER_FIELD = re.compile(r'"(id|type)"\s*:\s*("?)(-?\w+)\2')
+
+# Telegram Desktop "media_type" values worth delivering; posts with a "file"
+# and no media_type are documents
+EXPORT_MEDIA = {"video_file": "video", "audio_file": "audio", "animation": "video"}
+
+
+class ExportReader:
+    """Stream the "messages" array of a Telegram Desktop result.json.
+
+    Only the current chunk and one message are held in memory, so exports of
+    any size can be read. Opening the reader parses the scalar fields that
+    precede the array into ``header`` (chat ``id`` and ``type``);
+    ``bytes_read`` tracks progress.
+    """
+
+    def __init__(self, path: str, chunk_size: int = 1 << 16) -> None:
+        self.path = path
+        self.chunk_size = chunk_size
+        self.size = os.path.getsize(path)
+        self.bytes_read = 0
+        self.header = {}
+        self._fp = None
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._buf = ""
+
+    def __enter__(self):
+        self._fp = open(self.path, "rb")
+        while True:
+            match = EXPORT_MESSAGES_KEY.search(self._buf)
+            if match:
+                break
+            self._buf += self._read()
+        self.header = {key: value for key, _, value in EXPORT_HEADER_FIELD.findall(self._buf[:match.start()])}
+        self._buf = self._buf[match.end():]
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._fp.close()
+
+    def _read(self) -> str:
+        chunk = self._fp.read(self.chunk_size)
+        self.bytes_read += len(chunk)
+        if not chunk:
+            raise ValueError(f"{self.path}: unexpected end of export")
+        return self._utf8.decode(chunk)
+
+    def messages(self):
+        decoder = json.JSONDecoder()
+        while True:
+            self._buf = self._buf.lstrip(" \t\r\n,")
+            if not self._buf:
+                self._buf = self._read()
+                continue
+            if self._buf[0] == "]":
+                return
+            try:
+                message, end = decoder.raw_decode(self._buf)
+            except json.JSONDecodeError:
+                # Message continues in the next chunk
+                self._buf += self._read()
+                continue
+            self._buf = self._buf[end:]
+            yield message
+
+
+def export_text(message: dict) -> str:
+    """Plain text of an exported message; formatted text is a list of parts"""
+    text = message.get("text", "")
+    if isinstance(text, list):
+        text = "".join(part if isinstance(part, str) else part.get("text", "") for part in text)
+    return text.strip()
+
+
+def export_media_type(message: dict) -> Optional[str]:
+    if "photo" in message:
+        return "photo"
+    if "file" in message:
+        media_type = message.get("media_type")
+        if media_type is None:
+            return "document"
+        return EXPORT_MEDIA.get(media_type)
+    return None
+
+
+def group_export_titles(messages, source_chat_id: int):
+    """Yield ``(video_id, video)`` for each titled post and the media after it.
+
+    A photo with a caption starts a title (caption's first line as the title);
+    every following media post until the next one becomes a file. Ids are
+    derived from the channel and post id, so re-importing replaces titles
+    instead of duplicating them.
+    """
+    current = None
+    for message in messages:
+        if message.get("type") != "message":
+            continue
+        media = export_media_type(message)
+        if media is None:
+            continue
+        ref = {"type": COPY_TYPE, "file_id": f"{source_chat_id}/{message['id']}"}
+        caption = export_text(message)
+        if media == "photo" and caption:
+            if current:
+                yield current
+            video_id = f"c{abs(source_chat_id)}p{message['id']}"
+            current = (video_id, {
+                "title": caption.splitlines()[0][:200],
+                "poster": None,  # the copied title post carries photo and caption
+                "files": [ref],
+                "created_at": message.get("date"),
+                "created_by": None,
+            })
+        elif current:
+            current[1]["files"].append(ref)
+    if current:
+        yield current
+
+
+def import_export(path: str, source_chat_id: Optional[int], batch_size: int, dry_run: bool = False) -> dict:
+    """Bulk-load a channel export into the catalog store, `batch_size` titles per write"""
+    store = open_store()
+    try:
+        catalog = store.load_all()
+        counters = CatalogCounters()
+        counters.load(store, catalog)
+        with ExportReader(path) as reader:
+            if source_chat_id is None:
+                if "channel" not in reader.header.get("type", ""):
+                    raise ValueError("Not a channel export, pass --chat-id")
+                source_chat_id = int(f"-100{reader.header['id']}")
+            result = import_titles(store, catalog, counters, reader, source_chat_id, batch_size, dry_run)
+
+        if not dry_run:
+            store.put_record(CatalogCounters.NAMESPACE, CatalogCounters.KEY, counters.to_dict())
+        return result
+    finally:
+        store.close()
+
+
+def import_titles(store: VideoStore, catalog: dict, counters: CatalogCounters, reader: ExportReader,
+                  source_chat_id: int, batch_size: int, dry_run: bool) -> dict:
+    result = {"titles": 0, "new": 0, "files": 0, "skipped": 0}
+    batch = {}
+
+    def flush():
+        if not dry_run and batch:
+            store.upsert_videos(batch)
+        batch.clear()
+        print(
+            f"📥 {result['titles']} titles ({result['new']} new, {result['files']} files) - "
+            f"{reader.bytes_read * 100 // max(reader.size, 1)}% of {reader.path}",
+            flush=True,
+        )
+
+    for video_id, video in group_export_titles(reader.messages(), source_chat_id):
+        if len(video["files"]) < 2:
+            # Photo post with nothing after it, an announcement rather than a title
+            result["skipped"] += 1
+            continue
+        previous = catalog.get(video_id)
+        if previous:
+            counters.forget_video(previous)
+        else:
+            result["new"] += 1
+        counters.record_video(video)
+        catalog[video_id] = video
+        batch[video_id] = video
+        result["titles"] += 1
+        result["files"] += len(video["files"])
+        if len(batch) >= batch_size:
+            flush()
+    flush()
+    return result
+
+
+def import_main(argv: list) -> int:
+    parser = argparse.ArgumentParser(
+        prog="bot.py import",
+        description="Import a Telegram Desktop channel export (result.json) into the catalog. "
+                    "Posts are delivered with copyMessage, so the bot must stay a member of the "
+                    "source channel. Run it while the bot is stopped; it picks the titles up on start.",
+    )
+    parser.add_argument("export", help="path to result.json")
+    parser.add_argument("--chat-id", type=int, help="source channel id, default -100<id> from the export")
+    parser.add_argument("--batch-size", type=int, default=500, help="titles per store write")
+    parser.add_argument("--dry-run", action="store_true", help="parse and report without writing")
+    args = parser.parse_args(argv)
+
+    try:
+        result = import_export(args.export, args.chat_id, args.batch_size, args.dry_run)
+    except (OSError, ValueError) as e:
+        print(f"❌ Import failed: {e}")
+        return 1
+    print(
+        f"✅ Imported {result['titles']} titles ({result['new']} new, {result['files']} files), "
+        f"skipped {result['skipped']} captioned photos with no media after them"
+    )
+    return 0
 
-# ================== LOGGER ==================
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    level=logging.INFO,
-)
-logger = logging.getLogger(__name__)
 
 class BitluMawaBot:
     def __init__(self) -> None:
@@ -43,7 +2777,59 @@ class BitluMawaBot:
             if not BOT_TOKEN:
                 raise ValueError("BOT_TOKEN not set.")
 
-            self.app = ApplicationBuilder().token(BOT_TOKEN).build()
+            self.sub_cache = MembershipCache(
+                SUB_CACHE_POSITIVE_TTL, SUB_CACHE_NEGATIVE_TTL, SUB_CACHE_MAX_SIZE
+            )
+            self.join_links = {}  # channel -> join URL
+            self.scheduler = SendScheduler()
+            self.store = open_store()
+            self.update_processor = PerUserUpdateProcessor(
+                max(1, CONCURRENT_UPDATES), self.claim_update if self.store.shared else None
+            )
+            self.deliveries = DeliveryQueue(
+                self.store, self.run_delivery, DELIVERY_WORKERS, REPLICA_ID, SHARED_LOCK_TTL
+            )
+            self.sessions = SessionStore(self.store, SESSION_TTL, SESSION_MAX)
+            self.pending_albums = {}  # (user_id, media_group_id) -> files waiting for the debounce
+            self.video_id_lock = asyncio.Lock()  # held from picking a new title's id until it is in videos_data
+            self.feedback = FeedbackTally(self.store)
+            self.counters = CatalogCounters(shared=self.store.shared)
+            self.index = CatalogIndex()
+            self.files = FileRegistry()
+            self.inline_cache = LRUCache(INLINE_QUERY_CACHE_SIZE)
+            self.plans = LRUCache(DELIVERY_PLAN_CACHE_SIZE)  # (video_id, with poster) -> DeliveryPlan
+            self.recently_delivered = LRUCache(DELIVERY_COOLDOWN_SIZE)  # (user_id, video_id) -> finished at
+            self.seen_users = LRUCache(USER_CACHE_SIZE)
+            self.broadcasts = BroadcastRunner(
+                self.store, self.send_broadcast, BROADCAST_WORKERS, BROADCAST_PAGE_SIZE,
+                REPLICA_ID, SHARED_LOCK_TTL,
+            )
+            self.counters_task = None
+            self.shared_tasks = []  # catalog listener and lock upkeep, shared stores only
+            self.draining = False
+            self.ops_server = None
+            self.metrics_server = None
+            self.register_metrics()
+            self.app = (
+                ApplicationBuilder()
+                .token(BOT_TOKEN)
+                .base_url(BOT_API_URL)
+                .request(PooledRequest(
+                    "bot", HTTP_POOL_SIZE, HTTP_KEEPALIVE, HTTP_KEEPALIVE_EXPIRY, HTTP_CONNECT_TIMEOUT,
+                    HTTP_READ_TIMEOUT, HTTP_WRITE_TIMEOUT, HTTP_POOL_TIMEOUT, HTTP_VERSION,
+                ))
+                .get_updates_request(PooledRequest(
+                    "get_updates", UPDATES_POOL_SIZE, UPDATES_KEEPALIVE, UPDATES_KEEPALIVE_EXPIRY,
+                    UPDATES_CONNECT_TIMEOUT, UPDATES_READ_TIMEOUT, UPDATES_WRITE_TIMEOUT,
+                    UPDATES_POOL_TIMEOUT, UPDATES_HTTP_VERSION,
+                ))
+                .rate_limiter(self.scheduler)
+                .concurrent_updates(self.update_processor)
+                .post_init(self.post_init)
+                .post_stop(self.post_stop)
+                .post_shutdown(self.post_shutdown)
+                .build()
+            )
             self.setup_handlers()
             self.load_data()
             logger.info("Bot initialized successfully")
@@ -57,83 +2843,561 @@ class BitluMawaBot:
             CommandHandler("addvideo", self.add_video),
             CommandHandler("stats", self.stats),
             CommandHandler("listvideos", self.list_videos),
+            CommandHandler("find", self.find_videos),
             CommandHandler("testsub", self.test_subscription),
+            CommandHandler("broadcast", self.broadcast),
             MessageHandler(filters.ALL & ~filters.COMMAND, self.handle_inputs),
-            CallbackQueryHandler(self.button_callback),
+            CallbackQueryHandler(self.verify_callback, pattern=CALLBACK_PATTERNS["verify"]),
+            CallbackQueryHandler(self.copy_link_callback, pattern=CALLBACK_PATTERNS["copy"]),
+            CallbackQueryHandler(self.feedback_callback, pattern=CALLBACK_PATTERNS["feedback"]),
+            CallbackQueryHandler(self.page_callback, pattern=CALLBACK_PATTERNS["page"]),
+            CallbackQueryHandler(self.finish_video_callback, pattern=CALLBACK_PATTERNS["finish"]),
+            CallbackQueryHandler(self.continue_files_callback, pattern=CALLBACK_PATTERNS["continue"]),
+            CallbackQueryHandler(self.cancel_video_callback, pattern=CALLBACK_PATTERNS["cancel"]),
+            CallbackQueryHandler(self.expired_callback),
+            ChatMemberHandler(self.channel_member_update, ChatMemberHandler.CHAT_MEMBER),
+            InlineQueryHandler(self.inline_query),
         ]
         for h in handlers:
             self.app.add_handler(h)
 
-    def load_data(self):
-        global videos_data
+    async def post_init(self, app):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.begin_drain)
+            except (NotImplementedError, RuntimeError):
+                # Not available on Windows, KeyboardInterrupt still stops the bot there
+                pass
+
+        if HEALTH_PORT:
+            self.ops_server = OpsServer("0.0.0.0", HEALTH_PORT)
+            self.ops_server.route("/healthz", self.health_check)
+            if METRICS_PORT == HEALTH_PORT:
+                self.ops_server.route("/metrics", self.metrics_endpoint)
+            await self.ops_server.start()
+        if METRICS_PORT and METRICS_PORT != HEALTH_PORT:
+            self.metrics_server = OpsServer(METRICS_HOST, METRICS_PORT)
+            self.metrics_server.route("/metrics", self.metrics_endpoint)
+            await self.metrics_server.start()
+
+        await self.deliveries.start()
+        self.counters_task = asyncio.create_task(self.flush_counters_periodically())
+        await self.resume_broadcast()
+        if self.store.shared:
+            logger.info(f"Shared store, running as replica {REPLICA_ID}")
+            self.shared_tasks = [
+                asyncio.create_task(self.store.listen(RedisVideoStore.CATALOG_CHANNEL, self.on_catalog_event)),
+                asyncio.create_task(self.maintain_shared_state()),
+            ]
+        if app.job_queue:
+            app.job_queue.run_repeating(
+                self.sweep_sessions, interval=SESSION_SWEEP_INTERVAL, first=SESSION_SWEEP_INTERVAL
+            )
+        else:
+            logger.warning("No JobQueue, idle /addvideo drafts will not expire")
+
+    async def post_stop(self, app):
+        """Stop background senders while the bot can still send.
+
+        Application.shutdown closes the rate limiter and the HTTP client, so
+        anything still sending by post_shutdown would fail mid-request.
+        """
+        # Lock renewal would otherwise adopt jobs again after the queue stopped
+        for task in self.shared_tasks:
+            task.cancel()
+        await asyncio.gather(*self.shared_tasks, return_exceptions=True)
+        # Unfinished jobs stay in the store and resume on the next start
+        await self.deliveries.stop(DRAIN_TIMEOUT)
+        if self.broadcasts.running():
+            # Progress is checkpointed per page, the rest resumes on the next start
+            self.broadcasts.task.cancel()
+            await asyncio.gather(self.broadcasts.task, return_exceptions=True)
+            await self.broadcasts.release()
+
+    async def post_shutdown(self, app):
+        if self.counters_task:
+            self.counters_task.cancel()
+        await self.flush_counters()
+        await self.feedback.flush()
+        for server in (self.ops_server, self.metrics_server):
+            if server:
+                await server.stop()
+        self.store.close()
+
+    def begin_drain(self):
+        """Stop signal handler: report unhealthy, let in-flight updates finish, then exit."""
+        if self.draining:
+            return
+        self.draining = True
+        logger.info(f"Shutdown requested, draining {self.update_processor.in_flight} in-flight updates")
+        asyncio.get_running_loop().call_later(DRAIN_TIMEOUT, self.update_processor.cancel_in_flight)
+        # Leaves run_polling/run_webhook, which stops fetching updates and awaits pending handlers
+        raise SystemExit
+
+    def register_metrics(self):
+        cache, processor, deliveries, scheduler = (
+            self.sub_cache, self.update_processor, self.deliveries, self.scheduler
+        )
+        metrics.gauge("bitlu_updates_in_flight", "Updates being handled", lambda: processor.in_flight)
+        metrics.counter("bitlu_log_records_sampled_out_total", "INFO log lines dropped by the per-line cap",
+                        lambda: log_sampler.dropped)
+        metrics.counter("bitlu_updates_duplicate_total", "Updates already taken by another replica",
+                        lambda: processor.duplicates)
+        metrics.gauge("bitlu_deliveries_in_flight", "Delivery jobs being sent", lambda: deliveries.active)
+        metrics.gauge(
+            "bitlu_deliveries_queued", "Delivery jobs waiting for a worker",
+            lambda: deliveries.stats()["queued"],
+        )
+        metrics.gauge(
+            "bitlu_send_queue_depth", "Requests waiting for a global send token",
+            lambda: scheduler.stats()["queue_depth"],
+        )
+        metrics.counter("bitlu_sub_cache_hits_total", "Membership cache hits", lambda: cache.hits)
+        metrics.counter("bitlu_sub_cache_misses_total", "Membership cache misses", lambda: cache.misses)
+        metrics.gauge("bitlu_sub_cache_hit_ratio", "Membership cache hit ratio", cache.hit_rate)
+        metrics.gauge("bitlu_videos", "Titles in the catalog", lambda: len(videos_data))
+        broadcasts = self.broadcasts
+        metrics.gauge("bitlu_broadcast_rate", "Users reached per second by the running broadcast",
+                      lambda: broadcasts.rate if broadcasts.running() else 0)
+        files = self.files
+        metrics.gauge("bitlu_files_unique", "Distinct files in the catalog", lambda: len(files.files))
+        metrics.gauge("bitlu_files_shared", "Files used by more than one title",
+                      lambda: files.stats()["shared"])
+        sessions = self.sessions
+        metrics.gauge("bitlu_admin_sessions", "Open /addvideo drafts", lambda: len(sessions))
+        metrics.counter("bitlu_admin_sessions_expired_total", "Drafts dropped after the idle TTL",
+                        lambda: sessions.expired)
+        metrics.counter("bitlu_admin_sessions_evicted_total", "Drafts dropped by the size cap",
+                        lambda: sessions.evicted)
+        plans = self.plans
+        metrics.counter("bitlu_delivery_plan_cache_hits_total", "Deliveries that reused a compiled plan",
+                        lambda: plans.hits)
+        metrics.counter("bitlu_delivery_plan_cache_misses_total", "Delivery plans compiled",
+                        lambda: plans.misses)
+        inline_cache = self.inline_cache
+        metrics.counter("bitlu_inline_cache_hits_total", "Inline query result cache hits",
+                        lambda: inline_cache.hits)
+        metrics.counter("bitlu_inline_cache_misses_total", "Inline query result cache misses",
+                        lambda: inline_cache.misses)
+
+    def metrics_endpoint(self):
+        return 200, "text/plain; version=0.0.4; charset=utf-8", metrics.render()
+
+    def metrics_summary(self) -> str:
+        """Condensed metrics view for /stats"""
+        lines = [
+            f"📡 API Calls: {API_CALLS.total():.0f} "
+            f"({API_ERRORS.total():.0f} errors, {RETRY_AFTER.total():.0f} flood waits)\n"
+        ]
+        pool_wait = POOL_WAIT.mean(pool="bot")
+        if pool_wait is not None:
+            lines.append(f"🔌 HTTP pool wait: {pool_wait * 1000:.1f}ms avg, {POOL_TIMEOUTS.total():.0f} timeouts\n")
+        for name in ("start", "verify_callback", "handle_inputs", "run_delivery"):
+            mean = HANDLER_LATENCY.mean(handler=name)
+            if mean is not None:
+                lines.append(f"⏱ `{name}`: {mean * 1000:.0f}ms avg\n")
+        return "".join(lines)
+
+    def health_check(self):
+        body = json.dumps(
+            {
+                "status": "draining" if self.draining else "ok",
+                "mode": "webhook" if WEBHOOK_URL else "polling",
+                "updates_in_flight": self.update_processor.in_flight,
+                "deliveries": self.deliveries.stats(),
+                "videos": len(videos_data),
+            }
+        )
+        return (503 if self.draining else 200), "application/json", body
+
+    def load_data(self):
+        global videos_data
+        try:
+            videos_data = self.store.load_all()
+            logger.info(f"Loaded {len(videos_data)} videos")
+        except Exception as e:
+            logger.error(f"Error loading data: {e}")
+            videos_data = {}
+
+        self.index.build(videos_data)
+        self.files.build(videos_data)
+
+        try:
+            self.counters.load(self.store, videos_data)
+        except Exception as e:
+            logger.error(f"Error loading counters: {e}")
+
+        try:
+            self.feedback.load()
+        except Exception as e:
+            logger.error(f"Error loading feedback: {e}")
+
+        try:
+            self.sessions.load()
+            if len(self.sessions):
+                logger.info(f"Restored {len(self.sessions)} /addvideo drafts")
+        except Exception as e:
+            logger.error(f"Error loading sessions: {e}")
+
+    async def sweep_sessions(self, context: ContextTypes.DEFAULT_TYPE):
+        """JobQueue callback: expire idle /addvideo drafts"""
+        if self.store.shared:
+            # One replica sweeps per interval, over every replica's drafts
+            if not await asyncio.to_thread(
+                self.store.acquire_lock, "sessions-sweep", REPLICA_ID, SESSION_SWEEP_INTERVAL
+            ):
+                return
+            await self.sessions.reload()
+        expired = await self.sessions.sweep()
+        if expired:
+            logger.info(f"Expired {len(expired)} idle /addvideo drafts")
+            await self.notify_dropped_drafts(context.bot, expired, "expired after inactivity")
+
+    async def notify_dropped_drafts(self, bot, dropped: list, reason: str):
+        for user_id, session in dropped:
+            title = escape_markdown(session.get("title") or "Untitled")
+            files = len(session.get("files", []))
+            try:
+                await bot.send_message(
+                    user_id,
+                    f"⌛ *Draft Dropped*\n\n"
+                    f"Your draft *{title}* ({files} files) {reason}.\n"
+                    "Start again with /addvideo",
+                    parse_mode="Markdown",
+                )
+            except TelegramError as e:
+                logger.warning(f"Could not notify admin {user_id} about dropped draft: {e}")
+
+    async def flush_counters(self):
+        if not self.counters.dirty:
+            return
+        self.counters.dirty = False
+        if self.counters.shared:
+            await self.flush_shared_counters()
+            return
+        try:
+            await asyncio.to_thread(
+                self.store.put_record, CatalogCounters.NAMESPACE, CatalogCounters.KEY,
+                self.counters.to_dict(),
+            )
+        except Exception as e:
+            self.counters.dirty = True
+            logger.error(f"Error saving counters: {e}")
+
+    async def flush_shared_counters(self):
+        """Add this replica's delivery counts to the shared ones"""
+        counters = self.counters
+        if not counters.pending:
+            return
+        batch, counters.pending = counters.pending, {}
+        try:
+            await asyncio.to_thread(self.store.add_counts, CatalogCounters.SHARED_NAMESPACE, batch)
+        except Exception as e:
+            # Keep them for the next flush
+            for key, counts in batch.items():
+                pending = counters.pending.setdefault(key, {})
+                for name, n in counts.items():
+                    pending[name] = pending.get(name, 0) + n
+            counters.dirty = True
+            logger.error(f"Error saving counters: {e}")
+
+    async def refresh_shared_stats(self):
+        """Before /stats on a shared store: publish our counts and read everyone's"""
+        await self.flush_counters()
+        await self.feedback.flush()
+        try:
+            counts = await asyncio.to_thread(self.store.load_counts, CatalogCounters.SHARED_NAMESPACE)
+            stale = self.counters.apply_counts(counts)
+            if stale:
+                await asyncio.to_thread(
+                    self.store.delete_counts, CatalogCounters.SHARED_NAMESPACE, "minutes", stale
+                )
+            self.feedback.load()
+        except Exception as e:
+            logger.error(f"Error reading shared counters: {e}")
+
+    async def flush_counters_periodically(self):
+        while True:
+            await asyncio.sleep(COUNTERS_FLUSH_INTERVAL)
+            await self.flush_counters()
+            await self.feedback.flush()
+
+    # ================== SHARED STATE ==================
+    async def claim_update(self, update: object) -> bool:
+        """Webhook retries can reach another replica, only the first to see an update handles it"""
+        if not isinstance(update, Update):
+            return True
+        try:
+            # A fresh owner per call, so a retry to this same replica is refused as well
+            return await asyncio.to_thread(
+                self.store.acquire_lock, f"update:{update.update_id}", secrets.token_hex(8), UPDATE_DEDUP_TTL
+            )
+        except Exception as e:
+            logger.error(f"Could not claim update {update.update_id}, handling it anyway: {e}")
+            return True
+
+    async def on_catalog_event(self, event: dict):
+        """Apply a title added or removed on another replica"""
+        try:
+            if event.get("resync"):
+                catalog = await asyncio.to_thread(self.store.load_all)
+                for video_id in set(videos_data) | set(catalog):
+                    if videos_data.get(video_id) != catalog.get(video_id):
+                        self.apply_catalog_change(video_id, catalog.get(video_id))
+                logger.info(f"Catalog resynced, {len(videos_data)} videos")
+                return
+            video_id = event["video_id"]
+            self.apply_catalog_change(video_id, await asyncio.to_thread(self.store.get_video, video_id))
+        except Exception as e:
+            logger.error(f"Error applying catalog event {event}: {e}")
+
+    def apply_catalog_change(self, video_id: str, video: Optional[dict]):
+        old = videos_data.pop(video_id, None)
+        if old is not None:
+            self.counters.forget_video(old)
+            self.index.remove(video_id, old)
+            self.files.remove(video_id, old)
+        if video is not None:
+            videos_data[video_id] = video
+            self.counters.record_video(video)
+            self.index.add(video_id, video)
+            self.files.add(video_id, video)
+        self.forget_plans(video_id)
+        self.inline_cache.clear()
+
+    async def maintain_shared_state(self):
+        """Keep our locks alive and take over work left by replicas that went away"""
+        while True:
+            await asyncio.sleep(SHARED_LOCK_TTL / 3)
+            try:
+                adopted = await self.deliveries.refresh()
+                if adopted:
+                    logger.info(f"Took over {adopted} deliveries from another replica")
+                if self.broadcasts.running():
+                    await self.broadcasts.claim()
+                else:
+                    await self.resume_broadcast()
+            except Exception as e:
+                logger.error(f"Error maintaining shared state: {e}")
+
+    async def resume_broadcast(self):
+        job = await self.broadcasts.load()
+        if job and await self.broadcasts.claim():
+            logger.info(f"Resuming broadcast {job['id']} after user {job['cursor']}")
+            self.start_broadcast_task(job)
+
+    async def record_delivery(self, job: dict, ok: bool):
+        if ok:
+            self.recently_delivered.put((job["user_id"], job["video_id"]), time.time())
+            if self.store.shared:
+                try:
+                    await asyncio.to_thread(
+                        self.store.cache_set, f"sent:{job['user_id']}:{job['video_id']}", time.time(),
+                        DELIVERY_COOLDOWN,
+                    )
+                except Exception as e:
+                    logger.error(f"Error sharing delivery cooldown: {e}")
+        if self.counters.record_delivery(job["video_id"], job["user_id"], ok):
+            try:
+                await asyncio.to_thread(
+                    self.store.put_record, CatalogCounters.USERS_NAMESPACE, str(job["user_id"]), {}
+                )
+            except Exception as e:
+                logger.error(f"Error saving served user: {e}")
+
+    async def remember_user(self, user_id: int):
+        """Add a user to the broadcast list, skipping the write for recently seen users"""
+        if self.seen_users.get(user_id):
+            return
+        self.seen_users.put(user_id, True)
         try:
-            if os.path.exists("videos_data.json"):
-                with open("videos_data.json", "r", encoding="utf-8") as f:
-                    videos_data = json.load(f)
-                logger.info(f"Loaded {len(videos_data)} videos")
+            await asyncio.to_thread(self.store.add_users, [user_id])
         except Exception as e:
-            logger.error(f"Error loading data: {e}")
-            videos_data = {}
+            logger.error(f"Error saving user {user_id}: {e}")
 
-    def save_data(self):
+    async def save_data(self, video_id: str):
+        # Only the changed record is written, off the event loop
         try:
-            with open("videos_data.json", "w", encoding="utf-8") as f:
-                json.dump(videos_data, f, indent=2, ensure_ascii=False)
+            await asyncio.to_thread(self.store.upsert_video, video_id, videos_data[video_id])
         except Exception as e:
             logger.error(f"Error saving data: {e}")
 
     # ================== FORCE SUBSCRIPTION - FIXED ==================
-    async def check_subscription(self, user_id: int, context: ContextTypes.DEFAULT_TYPE) -> bool:
+    async def missing_channels(
+        self, user_id: int, context: ContextTypes.DEFAULT_TYPE, trust_negative: bool = True
+    ) -> list:
+        """FORCE_SUB_CHANNELS the user hasn't joined, in configured order.
+
+        Cached answers are used per (user, channel) and the rest are asked
+        concurrently; a channel that doesn't answer within SUB_CHECK_TIMEOUT
+        counts as not joined and isn't cached.
+        """
+        # Admin ki always allow
+        if user_id in ADMIN_IDS:
+            return []
+
+        if self.store.shared:
+            await self.load_shared_memberships(user_id)
+
+        missing, to_check = set(), []
+        for channel in FORCE_SUB_CHANNELS:
+            cached = self.sub_cache.get((user_id, channel))
+            if cached:
+                continue
+            # "Verify Now" taps skip a cached "not joined" - the user just claimed to have joined
+            if cached is False and trust_negative:
+                missing.add(channel)
+            else:
+                to_check.append(channel)
+
+        if to_check:
+            logger.info("Checking subscription for user %s in %s", user_id, ", ".join(to_check))
+            tasks = {
+                asyncio.create_task(self.is_channel_member(context.bot, channel, user_id)): channel
+                for channel in to_check
+            }
+            done, pending = await asyncio.wait(tasks, timeout=SUB_CHECK_TIMEOUT)
+            for task in pending:
+                task.cancel()
+                missing.add(tasks[task])
+                logger.warning(f"Subscription check for user {user_id} in {tasks[task]} timed out")
+            for task in done:
+                if not task.result():
+                    missing.add(tasks[task])
+
+        return [channel for channel in FORCE_SUB_CHANNELS if channel in missing]
+
+    async def load_shared_memberships(self, user_id: int):
+        """Copy answers other replicas already got from the API into the local cache"""
+        unknown = [channel for channel in FORCE_SUB_CHANNELS if self.sub_cache.peek((user_id, channel)) is None]
+        if not unknown:
+            return
         try:
-            # Admin ki always allow
-            if user_id in ADMIN_IDS:
-                return True
-                
-            logger.info(f"Checking subscription for user {user_id} in {FORCE_SUB_CHANNEL}")
-            
-            try:
-                member = await context.bot.get_chat_member(FORCE_SUB_CHANNEL, user_id)
-                status = member.status
-                
-                logger.info(f"User {user_id} status: {status}")
-                
-                if status in ["member", "administrator", "creator"]:
-                    return True
-                else:
-                    return False
-                    
-            except BadRequest as e:
-                logger.error(f"Error checking subscription: {e}")
-                return False
-                
+            answers = await asyncio.to_thread(
+                self.store.cache_get_many, [f"sub:{user_id}:{channel}" for channel in unknown]
+            )
         except Exception as e:
-            logger.error(f"Unexpected error in check_subscription: {e}")
+            logger.error(f"Error reading shared membership cache: {e}")
+            return
+        for channel, is_member in zip(unknown, answers):
+            if is_member is not None:
+                self.sub_cache.put((user_id, channel), is_member)
+
+    async def is_channel_member(self, bot, channel: str, user_id: int) -> bool:
+        try:
+            member = await bot.get_chat_member(channel, user_id)
+        except TelegramError as e:
+            logger.error(f"Error checking subscription to {channel}: {e}")
             return False
 
-    async def send_force_sub_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE, video_id: str = None):
+        logger.info("User %s status in %s: %s", user_id, channel, member.status)
+        is_member = member.status in ["member", "administrator", "creator"]
+        self.sub_cache.put((user_id, channel), is_member)
+        if self.store.shared:
+            ttl = SUB_CACHE_POSITIVE_TTL if is_member else SUB_CACHE_NEGATIVE_TTL
+            try:
+                await asyncio.to_thread(self.store.cache_set, f"sub:{user_id}:{channel}", is_member, ttl)
+            except Exception as e:
+                logger.error(f"Error sharing membership answer: {e}")
+        return is_member
+
+    async def join_link(self, bot, channel: str) -> Optional[str]:
+        if channel in self.join_links:
+            return self.join_links[channel]
+        if channel.startswith("@"):
+            link = f"https://t.me/{channel[1:]}"
+        else:
+            # Private channels are joined through their invite link
+            try:
+                chat = await bot.get_chat(channel)
+            except TelegramError as e:
+                logger.error(f"Error fetching invite link of {channel}: {e}")
+                return None
+            link = chat.invite_link or (f"https://t.me/{chat.username}" if chat.username else None)
+        self.join_links[channel] = link
+        return link
+
+    async def join_keyboard(self, bot, channels: list, video_id: Optional[str]) -> InlineKeyboardMarkup:
+        """Join buttons for `channels` followed by the Verify Now button"""
+        keyboard = []
+        for number, channel in enumerate(channels, 1):
+            link = await self.join_link(bot, channel)
+            if not link:
+                continue
+            if len(channels) == 1:
+                label = "🔥 Join Our Channel"
+            else:
+                label = f"🔥 Join {channel}" if channel.startswith("@") else f"🔥 Join Channel {number}"
+            keyboard.append([InlineKeyboardButton(label, url=link)])
+        keyboard.append([
+            InlineKeyboardButton(
+                "✅ I've Joined - Verify Now", callback_data=callback_data("v", video_id) if video_id else callback_data("v")
+            )
+        ])
+        return InlineKeyboardMarkup(keyboard)
+
+    async def remind_missing_channels(self, query, context: ContextTypes.DEFAULT_TYPE, missing: list, video_id: Optional[str]):
+        """Verify Now tapped too early: keep only the buttons of channels still missing"""
+        remaining = "the channel" if len(missing) == 1 else f"{len(missing)} channels"
+        await query.answer(f"❌ You haven't joined {remaining} yet! Join and try again.", show_alert=True)
         try:
-            channel_username = FORCE_SUB_CHANNEL.replace("@", "")
-            join_link = f"https://t.me/{channel_username}"
-            
-            keyboard = [
-                [InlineKeyboardButton("🔥 Join Our Channel", url=join_link)],
-                [InlineKeyboardButton("✅ I've Joined - Verify Now", callback_data=f"check_sub_{video_id}" if video_id else "check_sub")],
-            ]
+            await query.edit_message_reply_markup(await self.join_keyboard(context.bot, missing, video_id))
+        except BadRequest:
+            # Markup unchanged since the last tap
+            pass
+
+    async def channel_member_update(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Drop cached membership as soon as the channel reports a join/leave.
+
+        Telegram only sends these for channels where the bot is an admin.
+        """
+        member_update = update.chat_member
+        channel = force_sub_channel_of(member_update.chat) if member_update else None
+        if not channel:
+            return
+
+        user_id = member_update.new_chat_member.user.id
+        self.sub_cache.invalidate((user_id, channel))
+        if self.store.shared:
+            await asyncio.to_thread(self.store.cache_delete, f"sub:{user_id}:{channel}")
+        logger.info(
+            f"Channel membership changed for user {user_id}: "
+            f"{member_update.old_chat_member.status} -> {member_update.new_chat_member.status}"
+        )
+
+    async def send_force_sub_message(
+        self, update: Update, context: ContextTypes.DEFAULT_TYPE, missing: list, video_id: str = None
+    ):
+        """`missing` is passed in from the caller's check: timed out channels aren't cached, asking again would wait twice"""
+        try:
+            keyboard = await self.join_keyboard(context.bot, missing, video_id)
 
+            if len(missing) == 1:
+                join_text = (
+                    "To access all videos, you need to join our channel first!\n\n"
+                    "👇 *Follow these simple steps:*\n"
+                    "1. Click *'Join Our Channel'* button\n"
+                    "2. Join the channel\n"
+                )
+            else:
+                join_text = (
+                    f"To access all videos, you need to join these {len(missing)} channels first!\n\n"
+                    "👇 *Follow these simple steps:*\n"
+                    "1. Click each *'Join'* button\n"
+                    "2. Join every channel\n"
+                )
             message_text = (
                 "🔒 *Subscription Required!*\n\n"
                 "📢 **Bitlu Mawa🔥 Premium Content**\n\n"
-                "To access all videos, you need to join our channel first!\n\n"
-                "👇 *Follow these simple steps:*\n"
-                "1. Click *'Join Our Channel'* button\n"
-                "2. Join the channel\n"
+                f"{join_text}"
                 "3. Come back and click *'I've Joined - Verify Now'*\n\n"
                 "💡 **Note:** Without joining, you won't get any videos!"
             )
 
             await update.message.reply_text(
                 message_text,
-                reply_markup=InlineKeyboardMarkup(keyboard),
+                reply_markup=keyboard,
                 parse_mode="Markdown",
             )
         except Exception as e:
@@ -146,44 +3410,46 @@ class BitluMawaBot:
         await update.message.reply_text(
             f"🔍 *Subscription Test for {user_name}*\n\n"
             f"👤 User ID: `{user_id}`\n"
-            f"📢 Channel: {FORCE_SUB_CHANNEL}\n"
+            f"📢 Channels: {', '.join(FORCE_SUB_CHANNELS)}\n"
             f"👑 Admin: {'✅ Yes' if user_id in ADMIN_IDS else '❌ No'}\n\n"
             "Checking subscription status...",
             parse_mode="Markdown"
         )
         
-        is_subscribed = await self.check_subscription(user_id, context)
+        missing = await self.missing_channels(user_id, context)
         
-        if is_subscribed:
+        if not missing:
             await update.message.reply_text("✅ *SUBSCRIBED!* - You can access all content!")
         else:
             await update.message.reply_text(
                 "❌ *NOT SUBSCRIBED!* - Please join our channel!\n\n"
-                f"Join: {FORCE_SUB_CHANNEL}\n"
+                f"Join: {', '.join(missing)}\n"
                 "Then click: /testsub again to verify",
                 parse_mode="Markdown"
             )
 
+    @instrumented("start")
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         try:
             user_id = update.effective_user.id
             user_name = update.effective_user.first_name
 
-            logger.info(f"User {user_id} started the bot")
+            logger.info("User %s started the bot", user_id)
+            await self.remember_user(user_id)
 
             # Check force subscription for non-admins
             if user_id not in ADMIN_IDS:
-                is_subscribed = await self.check_subscription(user_id, context)
-                if not is_subscribed:
-                    logger.info(f"User {user_id} not subscribed, sending force sub message")
+                missing = await self.missing_channels(user_id, context)
+                if missing:
+                    logger.info("User %s not subscribed, sending force sub message", user_id)
                     video_id = context.args[0] if context.args else None
-                    await self.send_force_sub_message(update, context, video_id)
+                    await self.send_force_sub_message(update, context, missing, video_id)
                     return
 
             # /start with video ID
             if context.args:
                 video_id = context.args[0]
-                logger.info(f"User {user_id} requesting video: {video_id}")
+                logger.info("User %s requesting video: %s", user_id, video_id)
                 await self.send_video_to_user(update, context, video_id)
                 return
 
@@ -194,8 +3460,10 @@ class BitluMawaBot:
                     "📋 *Admin Commands:*\n"
                     "/addvideo - Add new video\n"
                     "/listvideos - View videos\n"
+                    "/find - Search titles\n"
                     "/stats - Bot statistics\n"
-                    "/testsub - Test subscription\n\n"
+                    "/testsub - Test subscription\n"
+                    "/broadcast - Message all users\n\n"
                     "🚀 Bot is ready to serve!",
                     parse_mode="Markdown",
                 )
@@ -220,12 +3488,13 @@ class BitluMawaBot:
             await update.message.reply_text("❌ *Admin Only!*", parse_mode="Markdown")
             return
 
-        user_sessions[user_id] = {
+        evicted = await self.sessions.start(user_id, {
             "step": "title",
             "title": None,
             "poster": None,
             "files": [],
-        }
+        })
+        await self.notify_dropped_drafts(context.bot, evicted, "was dropped to make room for new drafts")
 
         await update.message.reply_text(
             "🎬 *Video Addition Started*\n\n"
@@ -234,9 +3503,13 @@ class BitluMawaBot:
             parse_mode="Markdown",
         )
 
+    @instrumented("handle_inputs")
     async def handle_inputs(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
-        session = user_sessions.get(user_id)
+        # Only admins have /addvideo drafts, spare everyone else the store lookup
+        if user_id not in ADMIN_IDS:
+            return
+        session = await self.sessions.fetch(user_id)
         
         if not session:
             return
@@ -247,6 +3520,7 @@ class BitluMawaBot:
         if session["step"] == "title" and msg.text:
             session["title"] = msg.text.strip()
             session["step"] = "poster"
+            await self.sessions.save(user_id)
             await msg.reply_text(
                 "✅ *Title Saved!*\n\n"
                 "Step 2/3: Now send the *Poster Image*:\n\n"
@@ -259,6 +3533,7 @@ class BitluMawaBot:
         if session["step"] == "poster" and msg.photo:
             session["poster"] = msg.photo[-1].file_id
             session["step"] = "files"
+            await self.sessions.save(user_id)
             await msg.reply_text(
                 "🖼️ *Poster Received!*\n\n"
                 "Step 3/3: Now send the *Video Files*:\n\n"
@@ -275,15 +3550,18 @@ class BitluMawaBot:
         # STEP 3 - Files
         if session["step"] == "files":
             file_info = self.extract_file(msg)
+            if file_info and self.in_draft(session, file_info):
+                await msg.reply_text("⚠️ *Already in this draft*, skipped.", parse_mode="Markdown")
+                return
+            if file_info and msg.media_group_id:
+                self.collect_album_file(user_id, msg, file_info, context)
+                return
             if file_info:
                 session["files"].append(file_info)
                 count = len(session["files"])
+                await self.sessions.save(user_id)
 
-                keyboard = [
-                    [InlineKeyboardButton("✅ Finish & Generate Link", callback_data="finish_video")],
-                    [InlineKeyboardButton("➕ Add More Files", callback_data="continue_files")],
-                    [InlineKeyboardButton("❌ Cancel", callback_data="cancel_video")],
-                ]
+                keyboard = self.files_step_keyboard()
                 
                 file_type_emoji = {
                     "video": "🎥",
@@ -295,101 +3573,232 @@ class BitluMawaBot:
                 await msg.reply_text(
                     f"{file_type_emoji} *File #{count} Added!*\n\n"
                     f"📊 Total Files: {count}\n"
-                    f"📝 Type: {file_info['type']}\n\n"
+                    f"📝 Type: {file_info['type']}\n"
+                    f"{self.reuse_note([file_info])}\n"
                     "Choose next action:",
                     parse_mode="Markdown",
                     reply_markup=InlineKeyboardMarkup(keyboard),
                 )
 
+    def in_draft(self, session: dict, file_info: dict) -> bool:
+        key = file_key(file_info)
+        return any(file_key(f) == key for f in session["files"])
+
+    def reuse_note(self, files: list) -> str:
+        """Warning line for files that are already part of published titles"""
+        titles = set()
+        for f in files:
+            titles.update(self.files.titles_using(f))
+        if not titles:
+            return ""
+        names = ", ".join(
+            escape_markdown(videos_data.get(video_id, {}).get("title", video_id)) for video_id in sorted(titles)[:3]
+        )
+        more = f" +{len(titles) - 3} more" if len(titles) > 3 else ""
+        return f"♻️ Already used in: {names}{more}\n"
+
+    def files_step_keyboard(self) -> list:
+        return [
+            [InlineKeyboardButton("✅ Finish & Generate Link", callback_data=callback_data("d", "f"))],
+            [InlineKeyboardButton("➕ Add More Files", callback_data=callback_data("d", "m"))],
+            [InlineKeyboardButton("❌ Cancel", callback_data=callback_data("d", "x"))],
+        ]
+
+    def collect_album_file(self, user_id: int, msg, file_info: dict, context: ContextTypes.DEFAULT_TYPE):
+        """Buffer one item of a forwarded album, (re)arming the debounce that commits it.
+
+        Telegram delivers every album item as its own update; the album is
+        considered complete once no item arrived for ALBUM_DEBOUNCE seconds.
+        """
+        key = (user_id, msg.media_group_id)
+        pending = self.pending_albums.get(key)
+        if pending is None:
+            pending = self.pending_albums[key] = {
+                "chat_id": msg.chat_id,
+                "message_id": msg.message_id,
+                "files": [],
+                "timer": None,
+            }
+        else:
+            pending["timer"].cancel()
+        pending["files"].append((msg.message_id, file_info))
+        pending["timer"] = asyncio.get_running_loop().call_later(
+            ALBUM_DEBOUNCE,
+            lambda: context.application.create_task(self.commit_album(key, context.bot)),
+        )
+
+    async def commit_album(self, key: tuple, bot):
+        pending = self.pending_albums.pop(key, None)
+        user_id = key[0]
+        session = await self.sessions.fetch(user_id)
+        if not pending or not session or session["step"] != "files":
+            # Draft was finished or cancelled while the album was arriving
+            return
+
+        files = []
+        seen = {file_key(f) for f in session["files"]}
+        for _, file_info in sorted(pending["files"], key=lambda item: item[0]):
+            # Forwarding the same album twice must not double its files
+            if file_key(file_info) not in seen:
+                seen.add(file_key(file_info))
+                files.append(file_info)
+        skipped = len(pending["files"]) - len(files)
+        session["files"].extend(files)
+        await self.sessions.save(user_id)
+
+        if ALBUM_AUTO_FINISH:
+            video_id = await self.create_video(user_id, session)
+            text, markup = self.video_added_reply(bot.username, video_id, session)
+        else:
+            kinds = {}
+            for file_info in files:
+                kinds[file_info["type"]] = kinds.get(file_info["type"], 0) + 1
+            breakdown = ", ".join(f"{n} {kind}" for kind, n in kinds.items())
+            text = (
+                f"🗂️ *Album Added! ({len(files)} files)*\n\n"
+                f"📊 Total Files: {len(session['files'])}\n"
+                f"📝 Types: {breakdown or 'none'}\n"
+                + (f"⚠️ Skipped {skipped} already in this draft\n" if skipped else "")
+                + f"{self.reuse_note(files)}\n"
+                "Choose next action:"
+            )
+            markup = InlineKeyboardMarkup(self.files_step_keyboard())
+
+        try:
+            await bot.send_message(
+                pending["chat_id"],
+                text,
+                parse_mode="Markdown",
+                reply_markup=markup,
+                reply_to_message_id=pending["message_id"],
+            )
+        except TelegramError as e:
+            logger.error(f"Error confirming album for {user_id}: {e}")
+
     def extract_file(self, msg):
         try:
             if msg.video:
-                return {"type": "video", "file_id": msg.video.file_id}
-            if msg.document:
-                return {"type": "document", "file_id": msg.document.file_id}
-            if msg.audio:
-                return {"type": "audio", "file_id": msg.audio.file_id}
-            if msg.photo:
-                return {"type": "photo", "file_id": msg.photo[-1].file_id}
+                ftype, media = "video", msg.video
+            elif msg.document:
+                ftype, media = "document", msg.document
+            elif msg.audio:
+                ftype, media = "audio", msg.audio
+            elif msg.photo:
+                ftype, media = "photo", msg.photo[-1]
+            else:
+                return None
+            file_info = {"type": ftype, "file_id": media.file_id, "uid": media.file_unique_id}
+            metadata = {
+                "size": media.file_size,
+                "duration": getattr(media, "duration", None),
+                "mime_type": getattr(media, "mime_type", None),
+                "file_name": getattr(media, "file_name", None),
+            }
+            file_info.update((field, value) for field, value in metadata.items() if value is not None)
+            return file_info
         except Exception as e:
             logger.error(f"extract_file error: {e}")
         return None
 
-    async def button_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # ================== CALLBACK ROUTES ==================
+    # One CallbackQueryHandler per route (see CALLBACK_PATTERNS); each answers its query exactly once.
+    def log_callback(self, query):
+        logger.info("Button callback: %s from user %s", query.data, query.from_user.id)
+
+    async def reject_non_admin(self, query) -> bool:
+        """Answer a non-admin's tap on an admin button, returns True if it was one"""
+        if query.from_user.id in ADMIN_IDS:
+            return False
+        await query.answer("❌ Admin only feature!", show_alert=True)
+        return True
+
+    @instrumented("verify_callback")
+    async def verify_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
-        await query.answer()
-        user_id = query.from_user.id
-        data = query.data
-
-        logger.info(f"Button callback: {data} from user {user_id}")
-
-        # Force subscription check with video ID
-        if data.startswith("check_sub_"):
-            video_id = data.replace("check_sub_", "")
-            is_subscribed = await self.check_subscription(user_id, context)
-            
-            if is_subscribed:
-                await query.edit_message_text("✅ *Verified! Sending your video...*", parse_mode="Markdown")
-                # Send the video
-                await self.send_video_to_user_callback(query, context, video_id)
-            else:
-                await query.answer("❌ You haven't joined the channel yet! Join and try again.", show_alert=True)
+        self.log_callback(query)
+        video_id = context.match.group(1)
+        missing = await self.missing_channels(query.from_user.id, context, trust_negative=False)
+        if missing:
+            await self.remind_missing_channels(query, context, missing, video_id)
             return
 
-        # Regular force sub check
-        if data == "check_sub":
-            is_subscribed = await self.check_subscription(user_id, context)
-            if is_subscribed:
-                await query.edit_message_text(
-                    "✅ *Verified! Welcome to Bitlu Mawa🔥!*\n\n"
-                    "🎉 You've successfully joined our channel!\n\n"
-                    "Now you can access all videos!",
-                    parse_mode="Markdown"
-                )
-            else:
-                await query.answer("❌ You haven't joined the channel yet! Join and try again.", show_alert=True)
+        await query.answer()
+        if video_id:
+            await query.edit_message_text("✅ *Verified! Sending your video...*", parse_mode="Markdown")
+            await self.send_video_to_user_callback(query, context, video_id)
+        else:
+            await query.edit_message_text(
+                "✅ *Verified! Welcome to Bitlu Mawa🔥!*\n\n"
+                "🎉 You've successfully joined our channel!\n\n"
+                "Now you can access all videos!",
+                parse_mode="Markdown"
+            )
+
+    async def copy_link_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        self.log_callback(query)
+        share_link = f"https://t.me/{context.bot.username}?start={context.match.group(1)}"
+        await query.answer(f"🔗 Link Copied!\n\n{share_link}", show_alert=True)
+
+    async def feedback_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        self.log_callback(query)
+        code, video_id = context.match.group(1, 2)
+        kind, emoji = FEEDBACK_KINDS.get(code, (None, "👍"))
+        if kind:
+            # Buttons from before titles were tagged count under ""
+            self.feedback.record(video_id or "", kind)
+        await query.answer(f"{emoji} Thanks for your feedback!", show_alert=True)
+
+    async def page_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        self.log_callback(query)
+        if await self.reject_non_admin(query):
             return
+        await query.answer()
+        direction, cursor = context.match.group(1, 2)
+        text, markup = self.render_video_page(cursor, newer=direction.startswith("n"))
+        await query.edit_message_text(text, parse_mode="Markdown", reply_markup=markup)
 
-        # Copy link function
-        if data.startswith("copy_"):
-            video_id = data.replace("copy_", "")
-            share_link = f"https://t.me/{context.bot.username}?start={video_id}"
-            await query.answer(f"🔗 Link Copied!\n\n{share_link}", show_alert=True)
+    async def finish_video_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        self.log_callback(query)
+        if await self.reject_non_admin(query):
             return
+        await query.answer()
+        await self.finish_video_creation(query, context)
 
-        # Feedback buttons
-        if data.startswith("feedback_"):
-            feedback_type = data.replace("feedback_", "")
-            feedback_emojis = {
-                "love": "❤️",
-                "super": "🔥", 
-                "amazing": "💫",
-                "good": "👍"
-            }
-            emoji = feedback_emojis.get(feedback_type, "👍")
-            await query.answer(f"{emoji} Thanks for your feedback!", show_alert=True)
+    async def continue_files_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        self.log_callback(query)
+        if await self.reject_non_admin(query):
             return
+        await query.answer()
+        user_id = query.from_user.id
+        session = await self.sessions.fetch(user_id)
+        if session:
+            session["step"] = "files"
+            await self.sessions.save(user_id)
+        await query.edit_message_text("📁 *Continue adding files...*", parse_mode="Markdown")
 
-        # Admin-only functions
-        if user_id not in ADMIN_IDS:
-            await query.answer("❌ Admin only feature!", show_alert=True)
+    async def cancel_video_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        self.log_callback(query)
+        if await self.reject_non_admin(query):
             return
+        await query.answer()
+        await self.sessions.discard(query.from_user.id)
+        await query.edit_message_text("❌ Video addition cancelled.")
 
-        if data == "finish_video":
-            await self.finish_video_creation(query, context)
-        elif data == "continue_files":
-            session = user_sessions.get(user_id)
-            if session:
-                session["step"] = "files"
-            await query.edit_message_text("📁 *Continue adding files...*", parse_mode="Markdown")
-        elif data == "cancel_video":
-            if user_id in user_sessions:
-                del user_sessions[user_id]
-            await query.edit_message_text("❌ Video addition cancelled.")
+    async def expired_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Data no route understands, e.g. a button from a removed feature"""
+        query = update.callback_query
+        self.log_callback(query)
+        await query.answer("⌛ This button no longer works.")
 
     async def finish_video_creation(self, query, context: ContextTypes.DEFAULT_TYPE):
         user_id = query.from_user.id
-        session = user_sessions.get(user_id)
+        session = await self.sessions.fetch(user_id)
 
         if not session:
             await query.edit_message_text("❌ No active session! Start with /addvideo")
@@ -399,178 +3808,529 @@ class BitluMawaBot:
             await query.edit_message_text("❌ No files added! Add files first.")
             return
 
-        video_id = str(int(time.time()))
-        videos_data[video_id] = {
-            "title": session["title"],
-            "poster": session["poster"],
-            "files": session["files"],
-            "created_at": datetime.datetime.now().isoformat(),
-            "created_by": user_id,
-        }
-        self.save_data()
+        video_id = await self.create_video(user_id, session)
+        text, markup = self.video_added_reply(context.bot.username, video_id, session)
+        await query.edit_message_text(text, parse_mode="Markdown", reply_markup=markup)
 
-        if user_id in user_sessions:
-            del user_sessions[user_id]
+    async def create_video(self, user_id: int, session: dict) -> str:
+        """Turn a finished draft into a catalog entry and close the draft"""
+        # Admins finishing within the same second must not overwrite each other, on
+        # a shared store not even when they are on different replicas. The claim
+        # owner is per call: a lock we already hold would be refreshed, not refused.
+        owner = secrets.token_hex(8)
+        async with self.video_id_lock:
+            video_id = str(int(time.time()))
+            while video_id in videos_data or not await asyncio.to_thread(
+                self.store.acquire_lock, f"video-id:{video_id}", owner, SHARED_LOCK_TTL
+            ):
+                video_id = str(int(video_id) + 1)
+            videos_data[video_id] = {
+                "title": session["title"],
+                "poster": session["poster"],
+                "files": session["files"],
+                "created_at": datetime.datetime.now().isoformat(),
+                "created_by": user_id,
+            }
+        self.counters.record_video(videos_data[video_id])
+        self.index.add(video_id, videos_data[video_id])
+        self.files.add(video_id, videos_data[video_id])
+        self.forget_plans(video_id)
+        self.inline_cache.clear()
+        await self.save_data(video_id)
 
-        bot_username = context.bot.username
+        await self.sessions.discard(user_id)
+        return video_id
+
+    def video_added_reply(self, bot_username: str, video_id: str, session: dict) -> tuple:
         share_link = f"https://t.me/{bot_username}?start={video_id}"
 
         keyboard = [
             [InlineKeyboardButton("📤 Share Link", url=f"https://t.me/share/url?url={share_link}&text=🎬%20{session['title']}")],
-            [InlineKeyboardButton("🔗 Copy Link", callback_data=f"copy_{video_id}")],
+            [InlineKeyboardButton("🔗 Copy Link", callback_data=callback_data("c", video_id))],
         ]
 
-        await query.edit_message_text(
+        text = (
             f"🎉 *Video Added Successfully!*\n\n"
             f"🎬 Title: {session['title']}\n"
             f"📁 Files: {len(session['files'])}\n"
-            f"🔗 Link: `{share_link}`",
-            parse_mode="Markdown",
-            reply_markup=InlineKeyboardMarkup(keyboard),
+            f"🔗 Link: `{share_link}`"
         )
+        return text, InlineKeyboardMarkup(keyboard)
+
+    async def enqueue_delivery(self, chat_id: int, user, video_id: str, source: str) -> str:
+        """Queue a delivery; `source` is "start" (deep link) or "verify" (Verify Now tap).
+
+        Returns "queued", or "running"/"cooldown" when the request was folded
+        into a delivery that is under way or finished within DELIVERY_COOLDOWN.
+        """
+        if self.deliveries.find(user.id, video_id):
+            DUPLICATE_DELIVERIES.inc(reason="running")
+            return "running"
+        finished_at = self.recently_delivered.get((user.id, video_id))
+        if finished_at is None and self.store.shared and user.id not in ADMIN_IDS:
+            # Delivered by another replica
+            finished_at, = await asyncio.to_thread(self.store.cache_get_many, [f"sent:{user.id}:{video_id}"])
+        if finished_at and time.time() - finished_at < DELIVERY_COOLDOWN and user.id not in ADMIN_IDS:
+            DUPLICATE_DELIVERIES.inc(reason="cooldown")
+            return "cooldown"
+
+        job = {
+            "id": secrets.token_hex(8),
+            "chat_id": chat_id,
+            "user_id": user.id,
+            "user_name": user.first_name,
+            "video_id": video_id,
+            "source": source,
+            "next_file": 0,
+            "sent": 0,
+            "poster_sent": False,
+            "progress_message_id": None,
+            "created_at": time.time(),
+        }
+        if not await self.deliveries.submit(job):
+            # Another replica holds this request
+            DUPLICATE_DELIVERIES.inc(reason="running")
+            return "running"
+        return "queued"
+
+    async def reply_duplicate_request(self, message, status: str):
+        if status == "running":
+            await message.reply_text(
+                "⏳ *Already on its way!*\n\nYour files are being sent right now.",
+                parse_mode="Markdown",
+            )
+        elif status == "cooldown":
+            await message.reply_text(
+                "✅ *Already sent!*\n\nScroll up to find your files.",
+                parse_mode="Markdown",
+            )
+
+    def delivery_plan(self, video_id: str, video: dict, with_poster: bool) -> DeliveryPlan:
+        key = (video_id, with_poster)
+        plan = self.plans.get(key)
+        if plan is None:
+            plan = DeliveryPlan(video_id, video, with_poster)
+            self.plans.put(key, plan)
+        return plan
+
+    def forget_plans(self, video_id: str):
+        self.plans.pop((video_id, True))
+        self.plans.pop((video_id, False))
+
+    def remaining_steps(self, video_id: str, video: dict, job: dict) -> tuple:
+        """Plan and steps left for `job`, starting at its checkpointed file index"""
+        with_poster = job["source"] == "start" and not job["poster_sent"] and bool(video.get("poster"))
+        plan = self.delivery_plan(video_id, video, with_poster)
+        steps = plan.steps_from(job["next_file"])
+        if steps is None:
+            # The title changed since the checkpoint, compile the rest on its own
+            plan = DeliveryPlan(video_id, video, with_poster, job["next_file"])
+            steps = plan.steps
+        return plan, steps
+
+    @instrumented("run_delivery")
+    async def run_delivery(self, job: dict) -> bool:
+        """DeliveryQueue handler: send the rest of a job, checkpointing after every batch"""
+        bot = self.app.bot
+        chat_id = job["chat_id"]
+        video = videos_data.get(job["video_id"])
 
-    async def send_video_to_user(self, update: Update, context: ContextTypes.DEFAULT_TYPE, video_id: str):
         try:
-            user_id = update.effective_user.id
-            user_name = update.effective_user.first_name
+            if not video or not video.get("files"):
+                await bot.send_message(chat_id, "❌ Video not found.")
+                return True
 
-            logger.info(f"Sending video {video_id} to user {user_id}")
+            plan, steps = self.remaining_steps(job["video_id"], video, job)
+            show_progress = job.get("resumed") or len(steps) >= PROGRESS_MIN_BATCHES
+            if job.get("resumed") and job["next_file"]:
+                await self.report_progress(bot, job, plan, force=True)
 
-            # Check subscription for non-admins
-            if user_id not in ADMIN_IDS:
-                is_subscribed = await self.check_subscription(user_id, context)
-                if not is_subscribed:
-                    await self.send_force_sub_message(update, context, video_id)
-                    return
+            for step in steps:
+                if self.deliveries.stopping:
+                    return False
 
-            if video_id not in videos_data:
-                await update.message.reply_text("❌ Video not found.")
-                return
+                job["sent"] += await self.send_step_with_retry(bot, chat_id, step, plan.poster_caption)
+                job["next_file"] += step.files
+                job["poster_sent"] = job["poster_sent"] or step.poster
+                await self.deliveries.save(job)
+                if show_progress:
+                    await self.report_progress(bot, job, plan)
 
-            video = videos_data[video_id]
-            files = video.get("files", [])
+            if show_progress:
+                await self.report_progress(bot, job, plan, force=True)
 
-            if not files:
-                await update.message.reply_text("❌ No files available.")
-                return
+            if job["source"] == "start":
+                # Thank you message
+                thank_you_msg = (
+                    f"💖 **AMAZING {job['user_name'].upper()}!** 💖\n\n"
+                    f"✅ Successfully delivered *{job['sent']} files* of:\n"
+                    f"🎬 *{plan.title}*\n\n"
+                    f"🔥 *Bitlu Mawa Team*"
+                )
+                await bot.send_message(chat_id, thank_you_msg, parse_mode="Markdown", reply_markup=plan.feedback_markup)
+            else:
+                await bot.send_message(
+                    chat_id,
+                    f"✅ *Delivery Complete!*\n\n"
+                    f"Sent *{job['sent']} files* of:\n"
+                    f"🎬 *{plan.title}*\n\n"
+                    f"Enjoy! 🎉",
+                    parse_mode="Markdown"
+                )
+            await self.record_delivery(job, ok=True)
+            return True
 
-            # Send poster
-            if video.get("poster"):
-                try:
-                    await update.message.reply_photo(
-                        photo=video["poster"],
-                        caption=f"🎬 *{video['title']}*\n\nPreparing {len(files)} files...",
-                        parse_mode="Markdown",
-                    )
-                except Exception as e:
-                    logger.error(f"Error sending poster: {e}")
+        except Forbidden as e:
+            logger.info("User %s blocked the bot, dropping delivery: %s", job["user_id"], e)
+            await self.record_delivery(job, ok=False)
+            return True
+        except TelegramError as e:
+            if self.deliveries.stopping and is_transient_error(e):
+                logger.info("Delivery of %s to %s interrupted by shutdown, it resumes on the next start",
+                            job["video_id"], chat_id)
+                return False
+            logger.error(f"Delivery of {job['video_id']} to {chat_id} failed: {e}")
+            await self.record_delivery(job, ok=False)
+            try:
+                await bot.send_message(chat_id, "❌ Error sending files.")
+            except TelegramError:
+                pass
+            return True
 
-            # Send files
-            sent_count = 0
-            for f in files:
-                try:
-                    ftype = f.get("type")
-                    fid = f.get("file_id")
-
-                    if ftype == "video":
-                        await update.message.reply_video(fid)
-                    elif ftype == "document":
-                        await update.message.reply_document(fid)
-                    elif ftype == "audio":
-                        await update.message.reply_audio(fid)
-                    elif ftype == "photo":
-                        await update.message.reply_photo(fid)
+    async def report_progress(self, bot, job: dict, plan: DeliveryPlan, force: bool = False):
+        now = time.time()
+        if not force and now - job.get("progress_at", 0) < PROGRESS_INTERVAL:
+            return
+        job["progress_at"] = now
+
+        done = job["next_file"] >= plan.total
+        text = (
+            f"{'✅' if done else '📦'} *{plan.title}*\n\n"
+            f"{'Delivered' if done else 'Sending'} files: {job['next_file']}/{plan.total}"
+        )
+        try:
+            if job.get("progress_message_id"):
+                await bot.edit_message_text(
+                    text, chat_id=job["chat_id"], message_id=job["progress_message_id"],
+                    parse_mode="Markdown",
+                )
+            else:
+                message = await bot.send_message(job["chat_id"], text, parse_mode="Markdown")
+                job["progress_message_id"] = message.message_id
+                await self.deliveries.save(job)
+        except BadRequest as e:
+            # "Message is not modified" or the user deleted it - progress is best effort
+            logger.debug(f"Progress update skipped: {e}")
+
+    async def send_step_with_retry(self, bot, chat_id: int, step: PlanStep, poster_caption: str) -> int:
+        for attempt in range(1, DELIVERY_MAX_ATTEMPTS + 1):
+            try:
+                return await self.send_step(bot, chat_id, step, poster_caption)
+            except TelegramError as e:
+                # While stopping, leave the retry to whoever resumes the job
+                if not is_transient_error(e) or attempt == DELIVERY_MAX_ATTEMPTS or self.deliveries.stopping:
+                    raise
+                delay = DELIVERY_RETRY_BASE * 2 ** (attempt - 1)
+                logger.warning(
+                    f"Transient error sending to {chat_id}: {e} - retry {attempt} in {delay:.0f}s"
+                )
+                await asyncio.sleep(delay)
+
+    async def send_step(self, bot, chat_id: int, step: PlanStep, poster_caption: str) -> int:
+        """Send one album (or single file), returns the number of files sent"""
+        if step.media:
+            try:
+                await bot.send_media_group(chat_id, step.media)
+                return step.files
+            except BadRequest as e:
+                # One bad file_id fails the whole album - fall back to sending one by one
+                logger.error(f"Error sending album, retrying files one by one: {e}")
 
+        sent_count = 0
+        for f in step.batch:
+            try:
+                await self.send_single_file(bot, chat_id, f, poster_caption)
+                if not f.get("poster"):
                     sent_count += 1
-                    await asyncio.sleep(1)
-                except Exception as e:
-                    logger.error(f"Error sending file: {e}")
+            except BadRequest as e:
+                logger.error(f"Error sending file: {e}")
+        return sent_count
 
-            # Thank you message
-            thank_you_msg = (
-                f"💖 **AMAZING {user_name.upper()}!** 💖\n\n"
-                f"✅ Successfully delivered *{sent_count} files* of:\n"
-                f"🎬 *{video['title']}*\n\n"
-                f"🔥 *Bitlu Mawa Team*"
-            )
+    async def send_single_file(self, bot, chat_id: int, f: dict, poster_caption: str):
+        ftype = f.get("type")
+        fid = f.get("file_id")
 
-            feedback_keyboard = [
-                [InlineKeyboardButton("❤️ Loved It!", callback_data="feedback_love"),
-                 InlineKeyboardButton("🔥 Super", callback_data="feedback_super")],
-            ]
+        if f.get("poster"):
+            await bot.send_photo(chat_id, fid, caption=poster_caption, parse_mode="Markdown")
+        elif ftype == "video":
+            await bot.send_video(chat_id, fid)
+        elif ftype == "document":
+            await bot.send_document(chat_id, fid)
+        elif ftype == "audio":
+            await bot.send_audio(chat_id, fid)
+        elif ftype == "photo":
+            await bot.send_photo(chat_id, fid)
+        elif ftype == COPY_TYPE:
+            from_chat_id, message_id = fid.rsplit("/", 1)
+            await bot.copy_message(chat_id, int(from_chat_id), int(message_id))
 
-            await update.message.reply_text(
-                thank_you_msg,
-                parse_mode="Markdown",
-                reply_markup=InlineKeyboardMarkup(feedback_keyboard)
-            )
+    @instrumented("send_video_to_user")
+    async def send_video_to_user(self, update: Update, context: ContextTypes.DEFAULT_TYPE, video_id: str):
+        try:
+            user_id = update.effective_user.id
+
+            logger.info("Sending video %s to user %s", video_id, user_id)
+
+            # Check subscription for non-admins
+            if user_id not in ADMIN_IDS:
+                missing = await self.missing_channels(user_id, context)
+                if missing:
+                    await self.send_force_sub_message(update, context, missing, video_id)
+                    return
+
+            await self.request_delivery(update.message, update.effective_user, video_id, "start")
 
         except Exception as e:
             logger.error(f"Error in send_video_to_user: {e}")
             await update.message.reply_text("❌ Error sending files.")
 
+    @instrumented("send_video_to_user_callback")
     async def send_video_to_user_callback(self, query, context: ContextTypes.DEFAULT_TYPE, video_id: str):
         """Send video from callback (for force sub flow)"""
         try:
-            user_id = query.from_user.id
-            user_name = query.from_user.first_name
+            await self.request_delivery(query.message, query.from_user, video_id, "verify")
+        except Exception as e:
+            logger.error(f"Error in send_video_to_user_callback: {e}")
 
-            if video_id not in videos_data:
-                await query.message.reply_text("❌ Video not found.")
-                return
+    async def request_delivery(self, message, user, video_id: str, source: str):
+        """Queue `video_id` for `user` in the chat of `message`, replying there if it can't be sent"""
+        video = videos_data.get(video_id)
+        if video is None:
+            await message.reply_text("❌ Video not found.")
+            return
+        if not video.get("files"):
+            await message.reply_text("❌ No files available.")
+            return
+
+        status = await self.enqueue_delivery(message.chat_id, user, video_id, source)
+        await self.reply_duplicate_request(message, status)
 
-            video = videos_data[video_id]
-            files = video.get("files", [])
+    async def broadcast(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/broadcast <text>, or reply to a post with /broadcast to copy it to every user"""
+        if update.effective_user.id not in ADMIN_IDS:
+            await update.message.reply_text("❌ Admin only command!")
+            return
 
-            if not files:
-                await query.message.reply_text("❌ No files available.")
+        if context.args and context.args[0] == "cancel":
+            if self.broadcasts.running():
+                self.broadcasts.task.cancel()
+                await asyncio.gather(self.broadcasts.task, return_exceptions=True)
+            elif not await self.broadcasts.load():
+                await update.message.reply_text("📭 No broadcast running.")
                 return
+            # Removing the job also stops a run on another replica at its next page
+            await self.broadcasts.discard()
+            await update.message.reply_text("🛑 Broadcast cancelled.")
+            return
 
-            # Send files directly
-            sent_count = 0
-            for f in files:
-                try:
-                    ftype = f.get("type")
-                    fid = f.get("file_id")
-
-                    if ftype == "video":
-                        await query.message.reply_video(fid)
-                    elif ftype == "document":
-                        await query.message.reply_document(fid)
-                    elif ftype == "audio":
-                        await query.message.reply_audio(fid)
-                    elif ftype == "photo":
-                        await query.message.reply_photo(fid)
+        if self.broadcasts.running():
+            await update.message.reply_text(
+                f"⏳ A broadcast is already running.\n\n{self.broadcast_status(self.broadcasts.job)}\n\n"
+                "Send /broadcast cancel to stop it."
+            )
+            return
 
-                    sent_count += 1
-                    await asyncio.sleep(1)
-                except Exception as e:
-                    logger.error(f"Error sending file: {e}")
+        source = update.message.reply_to_message
+        text = update.message.text.split(maxsplit=1)[1] if context.args else None
+        if not source and not text:
+            await update.message.reply_text(
+                "📣 *Broadcast*\n\n"
+                "Reply to a post with /broadcast to copy it to every user,\n"
+                "or send `/broadcast your message`.",
+                parse_mode="Markdown",
+            )
+            return
 
-            await query.message.reply_text(
-                f"✅ *Delivery Complete!*\n\n"
-                f"Sent *{sent_count} files* of:\n"
-                f"🎬 *{video['title']}*\n\n"
-                f"Enjoy! 🎉",
-                parse_mode="Markdown"
+        if not await self.broadcasts.claim():
+            await update.message.reply_text(
+                "⏳ A broadcast is already running on another replica.\n\n"
+                "Send /broadcast cancel to stop it."
             )
+            return
+
+        total = await asyncio.to_thread(self.store.count_users)
+        status = await update.message.reply_text(f"📣 Broadcast starting to {total} users...")
+        job = {
+            "id": secrets.token_hex(8),
+            "from_chat_id": source.chat_id if source else None,
+            "message_id": source.message_id if source else None,
+            "text": None if source else text,
+            "admin_chat_id": update.effective_chat.id,
+            "status_message_id": status.message_id,
+            "cursor": 0,
+            "total": total,
+            "sent": 0,
+            "failed": 0,
+            "pruned": 0,
+            "created_at": time.time(),
+        }
+        await self.broadcasts.save(job)
+        self.start_broadcast_task(job)
+
+    def start_broadcast_task(self, job: dict):
+        self.broadcasts.task = asyncio.create_task(self.run_broadcast(job))
 
+    async def run_broadcast(self, job: dict):
+        last_report = 0.0
+
+        async def on_progress(job):
+            nonlocal last_report
+            if time.monotonic() - last_report >= BROADCAST_PROGRESS_INTERVAL:
+                last_report = time.monotonic()
+                await self.report_broadcast(job, self.broadcast_status(job))
+
+        try:
+            if not await self.broadcasts.run(job, on_progress):
+                logger.info(f"Broadcast {job['id']} was cancelled or taken over by another replica")
+                return
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
-            logger.error(f"Error in send_video_to_user_callback: {e}")
+            logger.error(f"Broadcast {job['id']} stopped: {e}")
+            await self.report_broadcast(job, f"❌ Broadcast stopped: {e}\n\n{self.broadcast_status(job)}")
+            return
+
+        elapsed = time.time() - job["created_at"]
+        await self.broadcasts.discard()
+        await self.report_broadcast(
+            job, f"✅ Broadcast finished in {elapsed / 60:.1f} min\n\n{self.broadcast_status(job)}"
+        )
+
+    def broadcast_status(self, job: dict) -> str:
+        done = BroadcastRunner.processed(job)
+        eta = self.broadcasts.eta(job)
+        return (
+            f"📣 {done}/{job['total']} users ({done * 100 // max(job['total'], 1)}%)\n"
+            f"✅ Sent: {job['sent']}  ❌ Failed: {job['failed']}  🚫 Blocked (removed): {job['pruned']}\n"
+            f"⚡ {self.broadcasts.rate:.1f} users/s"
+            + (f", ETA {eta / 60:.1f} min" if eta is not None and done < job["total"] else "")
+        )
+
+    async def report_broadcast(self, job: dict, text: str):
+        try:
+            await self.app.bot.edit_message_text(
+                text, chat_id=job["admin_chat_id"], message_id=job["status_message_id"]
+            )
+        except BadRequest as e:
+            logger.debug(f"Broadcast progress update skipped: {e}")
+        except TelegramError as e:
+            logger.warning(f"Could not update broadcast progress: {e}")
+
+    async def send_broadcast(self, user_id: int, job: dict):
+        bot = self.app.bot
+        if job["message_id"]:
+            await bot.copy_message(
+                user_id, job["from_chat_id"], job["message_id"], rate_limit_args=PRIORITY_BULK
+            )
+        else:
+            await bot.send_message(user_id, job["text"], rate_limit_args=PRIORITY_BULK)
+
+    @instrumented("inline_query")
+    async def inline_query(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """@bot <words> - search titles by word prefix, answered from the index"""
+        inline = update.inline_query
+        key = " ".join(tokenize(inline.query))
+        ids = self.inline_cache.get(key)
+        if ids is None:
+            # A burst of identical queries costs one index lookup
+            ids = self.index.prefix_search(key, INLINE_MAX_RESULTS)
+            self.inline_cache.put(key, ids)
+
+        offset = int(inline.offset) if inline.offset.isdigit() else 0
+        page = ids[offset:offset + INLINE_PAGE_SIZE]
+        next_offset = str(offset + INLINE_PAGE_SIZE) if offset + INLINE_PAGE_SIZE < len(ids) else ""
+
+        bot_username = context.bot.username
+        results = []
+        for video_id in page:
+            video = videos_data.get(video_id)
+            if not video:
+                continue
+            title = video["title"]
+            files = len(video.get("files", []))
+            markup = InlineKeyboardMarkup([[
+                InlineKeyboardButton("🎬 Get Video", url=f"https://t.me/{bot_username}?start={video_id}")
+            ]])
+            if video.get("poster"):
+                results.append(InlineQueryResultCachedPhoto(
+                    id=video_id,
+                    photo_file_id=video["poster"],
+                    title=title,
+                    description=f"{files} files",
+                    caption=f"🎬 *{escape_markdown(title)}*",
+                    parse_mode="Markdown",
+                    reply_markup=markup,
+                ))
+            else:
+                results.append(InlineQueryResultArticle(
+                    id=video_id,
+                    title=title,
+                    description=f"{files} files",
+                    input_message_content=InputTextMessageContent(
+                        f"🎬 *{escape_markdown(title)}*", parse_mode="Markdown"
+                    ),
+                    reply_markup=markup,
+                ))
+
+        await inline.answer(results, cache_time=INLINE_CACHE_TIME, next_offset=next_offset)
 
     async def stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         if update.effective_user.id not in ADMIN_IDS:
             await update.message.reply_text("❌ Admin only command!")
             return
 
-        total_videos = len(videos_data)
-        total_files = sum(len(v.get("files", [])) for v in videos_data.values())
+        if self.store.shared:
+            await self.refresh_shared_stats()
+        counters = self.counters
+        last_hour, last_day = counters.rates()
+        files_by_type = ", ".join(
+            f"{count} {ftype}" for ftype, count in sorted(counters.files_by_type.items())
+        )
+        top_titles = "".join(
+            f"   {rank}. {escape_markdown(videos_data.get(video_id, {}).get('title', video_id))}"
+            f" - {count}\n"
+            for rank, (video_id, count) in enumerate(counters.top_videos(), 1)
+        ) or "   none yet\n"
+        cache = self.sub_cache.stats()
+        registry = self.files.stats()
+        sched = self.scheduler.stats()
+        handlers = self.update_processor.stats()
+        deliveries = self.deliveries.stats()
+        feedback = " ".join(
+            f"{FEEDBACK_KINDS[kind][1]} {n}" for kind, n in sorted(self.feedback.totals.items()) if kind in FEEDBACK_KINDS
+        )
 
         await update.message.reply_text(
             f"📊 *Bot Statistics*\n\n"
-            f"🎬 Total Videos: {total_videos}\n"
-            f"📁 Total Files: {total_files}\n"
-            f"📢 Channel: {FORCE_SUB_CHANNEL}\n"
+            f"🎬 Total Videos: {counters.videos}\n"
+            f"📁 Total Files: {counters.total_files()} ({files_by_type or 'none'})\n"
+            f"🚚 Deliveries: {counters.deliveries_completed} done, {counters.deliveries_failed} failed\n"
+            f"📈 Last 1h / 24h: {last_hour} / {last_day}\n"
+            f"👥 Users Served: {len(counters.served_users)}\n"
+            f"♻️ Unique Files: {registry['files']} ({registry['references']} uses, "
+            f"{registry['shared']} shared across titles)\n"
+            f"🏆 Top Titles:\n{top_titles}"
+            f"💬 Feedback: {feedback or 'none yet'}\n"
+            f"📢 Channels: {', '.join(FORCE_SUB_CHANNELS)}\n"
+            f"🗂 Sub Cache: {cache['hits']} hits / {cache['misses']} misses "
+            f"({cache['hit_rate']:.0%}, {cache['size']} users)\n"
+            f"📨 Send Queue: {sched['queue_depth']} waiting, "
+            f"bulk wait p99 {sched['bulk_wait_p99']:.2f}s, "
+            f"{sched['retry_after']} flood waits\n"
+            f"⚡ Updates: p50 {handlers['p50'] * 1000:.0f}ms / p99 {handlers['p99'] * 1000:.0f}ms, "
+            f"{handlers['in_flight']} in flight\n"
+            f"📦 Deliveries: {deliveries['active']} running, {deliveries['queued']} queued\n"
+            f"{self.metrics_summary()}"
             f"🟢 Status: Running",
             parse_mode="Markdown",
         )
@@ -584,21 +4344,81 @@ class BitluMawaBot:
             await update.message.reply_text("📭 No videos stored yet.")
             return
 
-        txt = "🎬 *Stored Videos:*\n\n"
-        for vid, data in list(videos_data.items())[-10:]:
-            file_count = len(data.get('files', []))
-            txt += f"• {data['title']} ({file_count} files)\n   ID: `{vid}`\n\n"
+        text, markup = self.render_video_page()
+        await update.message.reply_text(text, parse_mode="Markdown", reply_markup=markup)
+
+    def format_video_line(self, vid: str) -> str:
+        data = videos_data[vid]
+        file_count = len(data.get('files', []))
+        return f"• {escape_markdown(data['title'])} ({file_count} files)\n   ID: `{vid}`\n\n"
+
+    def render_video_page(self, cursor: Optional[str] = None, newer: bool = False):
+        ids, start_rank = self.index.page(cursor, newer=newer)
+        total = len(self.index)
+        if not ids:
+            return "📭 No videos stored yet.", None
+
+        txt = f"🎬 *Stored Videos:* {start_rank + 1}-{start_rank + len(ids)} of {total}\n\n"
+        for vid in ids:
+            txt += self.format_video_line(vid)
+
+        buttons = []
+        if start_rank > 0:
+            buttons.append(InlineKeyboardButton("⬅️ Newer", callback_data=callback_data("p", "n", ids[0])))
+        if start_rank + len(ids) < total:
+            buttons.append(InlineKeyboardButton("Older ➡️", callback_data=callback_data("p", "o", ids[-1])))
+        return txt, InlineKeyboardMarkup([buttons]) if buttons else None
+
+    async def find_videos(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if update.effective_user.id not in ADMIN_IDS:
+            await update.message.reply_text("❌ Admin only command!")
+            return
+
+        if not context.args:
+            await update.message.reply_text(
+                "🔍 Usage: `/find <words from the title>`", parse_mode="Markdown"
+            )
+            return
+
+        query = " ".join(context.args)
+        ids = self.index.search(query)
+        if not ids:
+            await update.message.reply_text(f"🔍 No videos match: {query}")
+            return
 
+        txt = f"🔍 *{len(ids)} result(s) for* `{query.replace('`', '')}`\n\n"
+        for vid in ids:
+            txt += self.format_video_line(vid)
         await update.message.reply_text(txt, parse_mode="Markdown")
 
     def run(self):
         logger.info("🚀 Starting Bitlu Mawa Bot...")
         print("🤖 Bot is starting...")
         print("🔒 Force Subscribe: ENABLED")
-        print("📢 Channel:", FORCE_SUB_CHANNEL)
+        print("📢 Channels:", ", ".join(FORCE_SUB_CHANNELS))
         print("👑 Admin IDs:", ADMIN_IDS)
-        self.app.run_polling()
+
+        # chat_member updates are opt-in, they keep the membership cache fresh.
+        # Stop signals are handled by begin_drain (installed in post_init).
+        if WEBHOOK_URL:
+            secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+            print("🌐 Mode: webhook on port", PORT)
+            self.app.run_webhook(
+                listen="0.0.0.0",
+                port=PORT,
+                url_path=WEBHOOK_PATH,
+                webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+                secret_token=secret,
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+                allowed_updates=Update.ALL_TYPES,
+                stop_signals=None,
+            )
+        else:
+            print("🔄 Mode: polling")
+            self.app.run_polling(allowed_updates=Update.ALL_TYPES, stop_signals=None)
 
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["import"]:
+        sys.exit(import_main(sys.argv[2:]))
     bot = BitluMawaBot()
     bot.run()
@@ -0,0 +1,30 @@
+"""Titles created by concurrent /addvideo drafts."""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import bot  # noqa: E402
+
+
+def draft(title: str) -> dict:
+    return {"title": title, "poster": None, "files": [{"type": "video", "file_id": f"{title}-file"}]}
+
+
+def test_concurrent_create_video_gets_distinct_ids(tmp_path, monkeypatch):
+    monkeypatch.setattr(bot, "DB_PATH", str(tmp_path / "catalog.db"))
+    monkeypatch.setattr(bot, "DATA_FILE", str(tmp_path / "videos_data.json"))
+    monkeypatch.setattr(bot, "videos_data", {})
+    b = bot.BitluMawaBot()
+    try:
+        async def scenario():
+            return await asyncio.gather(b.create_video(1, draft("A")), b.create_video(2, draft("B")))
+
+        first, second = asyncio.run(scenario())
+        assert first != second
+        assert {bot.videos_data[first]["title"], bot.videos_data[second]["title"]} == {"A", "B"}
+        assert b.counters.videos == 2
+        assert {video["title"] for video in b.store.load_all().values()} == {"A", "B"}
+    finally:
+        b.store.close()
@@ -0,0 +1,89 @@
+"""Channel export import: streaming reader and title grouping."""
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import bot  # noqa: E402
+
+CHANNEL_ID = 1234567890
+SOURCE = int(f"-100{CHANNEL_ID}")
+
+MESSAGES = [
+    {"id": 1, "type": "service", "action": "create_channel", "title": "సినిమాలు"},
+    # Announcement: titled photo with no media after it
+    {"id": 2, "type": "message", "date": "2024-01-01T10:00:00", "photo": "photos/1.jpg",
+     "text": "Welcome to the channel"},
+    {"id": 3, "type": "message", "date": "2024-01-02T10:00:00", "photo": "photos/2.jpg",
+     "text": [{"type": "bold", "text": "సలార్ (2023)"}, " 1080p\nతెలుగు"]},
+    {"id": 4, "type": "message", "file": "video_files/a.mp4", "media_type": "video_file", "text": ""},
+    {"id": 5, "type": "message", "text": "plain chat between files"},
+    {"id": 6, "type": "message", "file": "files/subs.zip", "text": "subtitles"},
+    {"id": 7, "type": "message", "file": "stickers/s.webp", "media_type": "sticker", "text": ""},
+    {"id": 8, "type": "message", "date": "2024-01-03T10:00:00", "photo": "photos/3.jpg",
+     "text": "Second \"Title\" ]"},
+    {"id": 9, "type": "message", "file": "audio_files/song.mp3", "media_type": "audio_file", "text": ""},
+]
+
+CHUNK_SIZES = [1, 2, 3, 7, 64, 1 << 16]
+
+
+@pytest.fixture
+def export_path(tmp_path):
+    export = {"name": "సినిమాలు", "type": "public_channel", "id": CHANNEL_ID, "messages": MESSAGES}
+    path = tmp_path / "result.json"
+    path.write_text(json.dumps(export, ensure_ascii=False, indent=1), encoding="utf-8")
+    return str(path)
+
+
+@pytest.mark.parametrize("chunk_size", CHUNK_SIZES)
+def test_reader_streams_every_message(export_path, chunk_size):
+    with bot.ExportReader(export_path, chunk_size) as reader:
+        assert reader.header == {"type": "public_channel", "id": str(CHANNEL_ID)}
+        assert list(reader.messages()) == MESSAGES
+        assert reader.bytes_read <= reader.size
+
+
+def test_reader_rejects_truncated_export(tmp_path):
+    path = tmp_path / "result.json"
+    path.write_text('{"id": 1, "messages": [{"id": 1, "type": "mess', encoding="utf-8")
+    with bot.ExportReader(str(path), 8) as reader:
+        with pytest.raises(ValueError):
+            list(reader.messages())
+
+
+def test_group_export_titles():
+    titles = list(bot.group_export_titles(MESSAGES, SOURCE))
+    assert [video_id for video_id, _ in titles] == [
+        f"c{abs(SOURCE)}p2", f"c{abs(SOURCE)}p3", f"c{abs(SOURCE)}p8",
+    ]
+    announcement, salaar, second = (video for _, video in titles)
+    assert len(announcement["files"]) == 1
+    assert salaar["title"] == "సలార్ (2023) 1080p"
+    assert [f["file_id"] for f in salaar["files"]] == [f"{SOURCE}/3", f"{SOURCE}/4", f"{SOURCE}/6"]
+    assert all(f["type"] == bot.COPY_TYPE for f in salaar["files"])
+    assert second["title"] == 'Second "Title" ]'
+    assert second["created_at"] == "2024-01-03T10:00:00"
+
+
+@pytest.mark.parametrize("chunk_size", [3, 1 << 16])
+def test_import_is_idempotent(tmp_path, export_path, chunk_size):
+    store = bot.SQLiteVideoStore(str(tmp_path / "catalog.db"))
+    try:
+        catalog, counters = {}, bot.CatalogCounters()
+        results = []
+        for _ in range(2):
+            with bot.ExportReader(export_path, chunk_size) as reader:
+                results.append(bot.import_titles(store, catalog, counters, reader, SOURCE, 1, False))
+    finally:
+        store.close()
+
+    first, second = results
+    assert first == {"titles": 2, "new": 2, "files": 5, "skipped": 1}
+    assert second == {"titles": 2, "new": 0, "files": 5, "skipped": 1}
+    assert sorted(catalog) == [f"c{abs(SOURCE)}p3", f"c{abs(SOURCE)}p8"]
+    assert counters.videos == 2
+    assert counters.files_by_type == {bot.COPY_TYPE: 5}
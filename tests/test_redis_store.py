@@ -0,0 +1,89 @@
+"""RedisVideoStore against fakeredis (pip install -r requirements-dev.txt)."""
+import asyncio
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+fakeredis = pytest.importorskip("fakeredis")
+
+import bot  # noqa: E402
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def store(server):
+    store = bot.RedisVideoStore(
+        "redis://fake", "test:",
+        client=fakeredis.FakeRedis(server=server),
+        async_client=fakeredis.aioredis.FakeRedis(server=server),
+    )
+    yield store
+    store.close()
+
+
+def test_acquire_lock_refreshes_own_and_refuses_foreign(store):
+    assert store.acquire_lock("job", "a", 1)
+    # Held by us: refreshed, the TTL is extended
+    assert store.acquire_lock("job", "a", 60)
+    assert store._client.pttl(store._key("lock", "job")) > 1000
+    assert not store.acquire_lock("job", "b", 60)
+
+
+def test_release_lock_only_by_owner(store):
+    store.acquire_lock("job", "a", 60)
+    store.release_lock("job", "b")
+    assert not store.acquire_lock("job", "b", 60)
+    store.release_lock("job", "a")
+    assert store.acquire_lock("job", "b", 60)
+
+
+def test_user_ids_after_pages_in_id_order(store):
+    store.add_users([30, 10, 20, 40])
+    store.add_users([10])
+    assert store.count_users() == 4
+    assert store.user_ids_after(0, 2) == [10, 20]
+    assert store.user_ids_after(20, 2) == [30, 40]
+    assert store.user_ids_after(40, 2) == []
+
+
+def test_counts_add_up_and_delete(store):
+    store.add_counts("feedback", {"v1": {"love": 2}, "v2": {"super": 1}})
+    store.add_counts("feedback", {"v1": {"love": 1, "super": 1}})
+    assert store.load_counts("feedback") == {"v1": {"love": 3, "super": 1}, "v2": {"super": 1}}
+    store.delete_counts("feedback", "v1", ["love"])
+    assert store.load_counts("feedback") == {"v1": {"super": 1}, "v2": {"super": 1}}
+    assert store.load_counts("other") == {}
+
+
+def test_listen_skips_own_replica_events(store):
+    async def scenario():
+        events = []
+        received = asyncio.Event()
+
+        async def on_event(event):
+            events.append(event)
+            received.set()
+
+        task = asyncio.create_task(store.listen(store.CATALOG_CHANNEL, on_event))
+        channel = store._key(store.CATALOG_CHANNEL)
+        while not (await store._async_client.pubsub_numsub(channel))[0][1]:
+            await asyncio.sleep(0.01)
+
+        # Announced with this process's REPLICA_ID, then one from another replica
+        await asyncio.to_thread(store.upsert_video, "own", {"title": "Own", "files": []})
+        other = {"origin": "other-replica", "video_id": "theirs"}
+        await store._async_client.publish(channel, json.dumps(other))
+        await asyncio.wait_for(received.wait(), 5)
+
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return events
+
+    assert asyncio.run(scenario()) == [{"origin": "other-replica", "video_id": "theirs"}]